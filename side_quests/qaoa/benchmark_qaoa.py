@@ -0,0 +1,319 @@
+"""Benchmarks the QAOA utilities on random MaxCut instances and compares the timings with a baseline.
+
+Usage:
+    python benchmark_qaoa.py --sizes 4 8 12 16 20 24 --layers 1 2 3 4 5 --output benchmark.json
+    python benchmark_qaoa.py --sizes 4 8 12 --layers 1 2 --output new.json --baseline benchmark.json
+
+For each random regular and Erdős–Rényi graph (generated with networkx from a fixed seed), the benchmark times
+    - the exact solution (compute_exact_sol_cached, from an empty cache),
+    - a single cost evaluation on AerSimulator (QAOACostFunction, as in the cost loop of the notebooks),
+    - the same cost evaluation with the dedicated statevector simulator (QAOASimulator), and its speedup over AerSimulator,
+    - a full optimization (COBYLA on the same cost function),
+    - the scoring of the optimized parameters (calc_score),
+and records the peak memory allocated by each of them. The timings are measured without memory tracing; the peak memory
+is measured by a second, traced run of each instance (skipped with --skip-memory). The caches of problemes_utils are
+cleared before each run of an instance. The results are written to a JSON file. With --baseline, each timing is
+compared to the one of the same stage and instance in a previous file, and the command fails if one of them is slower
+than the tolerance allows.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import networkx as nx
+import numpy as np
+import qiskit
+import qiskit_aer
+from scipy.optimize import minimize
+
+from qiskit.quantum_info import SparsePauliOp
+from qiskit_aer import AerSimulator
+
+from problemes_utils import QAOACostFunction, calc_score, clear_caches, compute_exact_sol_cached
+from qaoa_simulator import QAOASimulator
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Version of the layout of the benchmark files
+BENCHMARK_FORMAT_VERSION = 1
+# Graph families of the benchmark instances
+GRAPH_TYPES = ["regular", "erdos_renyi"]
+# Timings shorter than this (s) are too noisy to be reported as regressions
+MIN_COMPARED_TIME = 0.05
+
+
+def maxcut_hamiltonian(graph: nx.Graph) -> SparsePauliOp:
+    """Builds the MaxCut Hamiltonian sum_(i,j) w_ij Z_i Z_j of a graph, as in the notebooks.
+
+    Args:
+        graph (nx.Graph): Graph whose nodes are 0, ..., n - 1, with an optional "weight" attribute on the edges.
+
+    Returns:
+        SparsePauliOp: Hamiltonian on graph.number_of_nodes() qubits, minimal on the maximal cuts.
+    """
+    terms = [("ZZ", [i, j], weight) for i, j, weight in graph.edges(data="weight", default=1.0)]
+    if not terms:
+        # Graph without edges: every cut is optimal
+        terms = [("", [], 0.0)]
+    return SparsePauliOp.from_sparse_list(terms, num_qubits=graph.number_of_nodes())
+
+
+def generate_graph(graph_type: str, num_nodes: int, seed: int, degree: int = 3, edge_prob: float = 0.5) -> nx.Graph:
+    """Generates a random benchmark graph.
+
+    Args:
+        graph_type (str): "regular" for a random degree-regular graph or "erdos_renyi" for a G(n, p) graph.
+        num_nodes (int): Number of nodes (qubits).
+        seed (int): Seed of networkx's random generator.
+        degree (int, optional): Degree of the regular graphs, lowered when num_nodes * degree is odd. Defaults to 3.
+        edge_prob (float, optional): Edge probability of the Erdős–Rényi graphs. Defaults to 0.5.
+
+    Returns:
+        nx.Graph: Random graph.
+    """
+    if graph_type == "regular":
+        degree = min(degree, num_nodes - 1)
+        if num_nodes * degree % 2:
+            degree -= 1
+        return nx.random_regular_graph(degree, num_nodes, seed=seed)
+    if graph_type == "erdos_renyi":
+        return nx.gnp_random_graph(num_nodes, edge_prob, seed=seed)
+    raise ValueError(f"Unknown graph type '{graph_type}', expected one of {GRAPH_TYPES}.")
+
+
+def _max_rss_mb() -> float | None:
+    """Peak resident memory of the process (MB), including the memory allocated by Aer, if available."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 2**10
+
+
+def _measure(stage: str, trace_memory: bool, function, *args, **kwargs) -> tuple[object, dict]:
+    """Runs a benchmark stage, measuring its wall time, or the peak memory it allocates through Python if trace_memory
+    (tracing slows down the allocations, so the time of a traced run is not recorded).
+
+    Returns:
+        tuple[object, dict]: Result of the function and record of the stage.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    if not trace_memory:
+        return result, {"stage": stage, "time_s": elapsed, "max_rss_mb": _max_rss_mb()}
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, {"stage": stage, "peak_memory_mb": peak / 2**20, "max_rss_mb": _max_rss_mb()}
+
+
+def benchmark_instance(
+    hamiltonian: SparsePauliOp, layers: list[int], maxiter: int, seed: int, trace_memory: bool = False
+) -> list[dict]:
+    """Benchmarks every stage of the QAOA workflow on a single Hamiltonian, from empty caches.
+
+    Args:
+        hamiltonian (SparsePauliOp): MaxCut Hamiltonian of the instance.
+        layers (list[int]): Numbers of QAOA layers to benchmark.
+        maxiter (int): Maximal number of COBYLA iterations of the optimization.
+        seed (int): Seed of the initial parameters of the optimizations.
+        trace_memory (bool, optional): Measure the peak memory of each stage instead of its time. Defaults to False.
+
+    Returns:
+        list[dict]: One record per stage, with its "stage", "num_layers", "max_rss_mb" and "time_s" or "peak_memory_mb".
+    """
+    rng = np.random.default_rng(seed)
+    clear_caches()
+    # The exact solution does not depend on the number of layers. It is cached for the scoring stages, as when
+    # grading several submissions of an instance, so every scoring stage only reads it.
+    (min_cost, _), record = _measure("exact_solution", trace_memory, compute_exact_sol_cached, hamiltonian)
+    records = [{**record, "num_layers": None, "min_cost": float(min_cost)}]
+
+    for num_layers in layers:
+        initial_params = rng.uniform(0, np.pi, 2 * num_layers)
+
+        # Circuit construction and transpilation happen once per cost function, as in the notebooks
+        cost_function, record = _measure(
+            "setup", trace_memory, QAOACostFunction, hamiltonian, num_layers, AerSimulator()
+        )
+        records.append({**record, "num_layers": num_layers})
+        _, record = _measure("cost_evaluation", trace_memory, cost_function, initial_params)
+        records.append({**record, "num_layers": num_layers})
+        aer_record = record
+
+        # Same evaluation without circuit nor transpilation
+        simulator, record = _measure("simulator_setup", trace_memory, QAOASimulator, hamiltonian, num_layers)
+        records.append({**record, "num_layers": num_layers})
+        _, record = _measure("simulator_evaluation", trace_memory, simulator, initial_params)
+        if not trace_memory:
+            record["speedup"] = aer_record["time_s"] / record["time_s"]
+        records.append({**record, "num_layers": num_layers})
+
+        result, record = _measure(
+            "optimization",
+            trace_memory,
+            minimize,
+            cost_function,
+            initial_params,
+            method="COBYLA",
+            options={"maxiter": maxiter},
+        )
+        records.append({**record, "num_layers": num_layers, "num_evals": int(result.nfev), "cost": float(result.fun)})
+
+        # The exact solution comes from the cache filled by the first stage, the estimated circuit from the setup stage
+        (cost, score), record = _measure(
+            "scoring", trace_memory, calc_score, result.x, num_layers, hamiltonian, AerSimulator()
+        )
+        records.append({**record, "num_layers": num_layers, "cost": float(cost), "score": float(score)})
+    return records
+
+
+def run_benchmark(
+    sizes: list[int],
+    layers: list[int],
+    graph_types: list[str] = GRAPH_TYPES,
+    seed: int = 0,
+    maxiter: int = 50,
+    trace_memory: bool = True,
+) -> dict:
+    """Benchmarks the QAOA utilities on one random graph per graph type and size.
+
+    Args:
+        sizes (list[int]): Numbers of qubits (graph nodes).
+        layers (list[int]): Numbers of QAOA layers.
+        graph_types (list[str], optional): Graph families, among GRAPH_TYPES. Defaults to GRAPH_TYPES.
+        seed (int, optional): Seed of the graphs and of the initial parameters. Defaults to 0.
+        maxiter (int, optional): Maximal number of COBYLA iterations of the optimizations. Defaults to 50.
+        trace_memory (bool, optional): Run each instance a second time to measure the peak memory of its stages.
+            Defaults to True.
+
+    Returns:
+        dict: Benchmark with its "metadata" (configuration and environment) and its "results" (one record per stage).
+    """
+    results = []
+    for graph_type in graph_types:
+        for num_qubits in sizes:
+            graph = generate_graph(graph_type, num_qubits, seed=seed + num_qubits)
+            hamiltonian = maxcut_hamiltonian(graph)
+            print(f"{graph_type} graph, {num_qubits} qubits, {graph.number_of_edges()} edges")
+            records = benchmark_instance(hamiltonian, layers, maxiter, seed=seed + num_qubits)
+            if trace_memory:
+                # Same stages in the same order, from the same empty caches
+                memory_records = benchmark_instance(
+                    hamiltonian, layers, maxiter, seed=seed + num_qubits, trace_memory=True
+                )
+                for record, memory_record in zip(records, memory_records):
+                    record["peak_memory_mb"] = memory_record["peak_memory_mb"]
+            for record in records:
+                record.update(graph=graph_type, num_qubits=num_qubits, num_edges=graph.number_of_edges())
+                speedup = f" (x{record['speedup']:.1f} vs AerSimulator)" if "speedup" in record else ""
+                print(f"    {record['stage']:<20} p={record['num_layers']} : {record['time_s']:.3f} s{speedup}")
+                results.append(record)
+
+    metadata = {
+        "format_version": BENCHMARK_FORMAT_VERSION,
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "sizes": sizes,
+        "layers": layers,
+        "graph_types": graph_types,
+        "seed": seed,
+        "maxiter": maxiter,
+        "trace_memory": trace_memory,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "qiskit": qiskit.__version__,
+        "qiskit_aer": qiskit_aer.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    return {"metadata": metadata, "results": results}
+
+
+def _record_key(record: dict) -> tuple:
+    """Identifies the stage and instance of a benchmark record."""
+    return record["graph"], record["num_qubits"], record["num_layers"], record["stage"]
+
+
+def compare_benchmarks(current: dict, baseline: dict, tolerance: float = 0.2) -> list[dict]:
+    """Compares the timings of a benchmark with the ones of the same stages and instances in a baseline.
+
+    Args:
+        current (dict): Benchmark returned by run_benchmark.
+        baseline (dict): Previous benchmark, as loaded from its JSON file.
+        tolerance (float, optional): Allowed relative slowdown. Defaults to 0.2 (20 %).
+
+    Returns:
+        list[dict]: One comparison per stage found in both benchmarks, with the baseline and current times, their
+            "ratio" and whether it is a "regression" (slower than the tolerance and than MIN_COMPARED_TIME).
+    """
+    baseline_times = {_record_key(record): record["time_s"] for record in baseline["results"]}
+    comparisons = []
+    for record in current["results"]:
+        key = _record_key(record)
+        if key not in baseline_times:
+            continue
+        baseline_time, current_time = baseline_times[key], record["time_s"]
+        ratio = current_time / baseline_time if baseline_time > 0 else np.inf
+        regression = ratio > 1 + tolerance and current_time - baseline_time > MIN_COMPARED_TIME
+        comparisons.append(
+            {
+                **dict(zip(["graph", "num_qubits", "num_layers", "stage"], key)),
+                "baseline_time_s": baseline_time,
+                "time_s": current_time,
+                "ratio": ratio,
+                "regression": regression,
+            }
+        )
+    return comparisons
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the QAOA utilities on random MaxCut instances.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4, 8, 12, 16, 20, 24], help="Numbers of qubits.")
+    parser.add_argument("--layers", type=int, nargs="+", default=[1, 2, 3, 4, 5], help="Numbers of QAOA layers.")
+    parser.add_argument("--graphs", nargs="+", choices=GRAPH_TYPES, default=GRAPH_TYPES, help="Graph families.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the graphs and of the initial parameters.")
+    parser.add_argument("--maxiter", type=int, default=50, help="Maximal number of COBYLA iterations.")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file where the results are written.")
+    parser.add_argument("--baseline", default=None, help="Previous JSON results to compare the timings with.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown (default: 0.2).")
+    parser.add_argument("--skip-memory", action="store_true", help="Skip the traced runs measuring the peak memory.")
+    args = parser.parse_args()
+
+    benchmark = run_benchmark(
+        args.sizes, args.layers, args.graphs, seed=args.seed, maxiter=args.maxiter, trace_memory=not args.skip_memory
+    )
+    with open(args.output, "w") as file:
+        json.dump(benchmark, file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        comparisons = compare_benchmarks(benchmark, baseline, tolerance=args.tolerance)
+        for comparison in comparisons:
+            print(
+                f"{comparison['graph']:<12} n={comparison['num_qubits']:<3} p={comparison['num_layers']} "
+                f"{comparison['stage']:<20} {comparison['baseline_time_s']:.3f} s -> {comparison['time_s']:.3f} s "
+                f"(x{comparison['ratio']:.2f}){'  REGRESSION' if comparison['regression'] else ''}"
+            )
+        regressions = sum(comparison["regression"] for comparison in comparisons)
+        print(f"{len(comparisons)} stage(s) compared, {regressions} regression(s)")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
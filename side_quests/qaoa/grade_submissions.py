@@ -0,0 +1,242 @@
+"""Grades a directory of QAOA submissions (files generated by problemes_utils.save_res) and writes a leaderboard.
+
+Usage:
+    python grade_submissions.py submissions/ --output leaderboard.csv --workers 8 --timeout 300
+    python grade_submissions.py submissions/ --fake-backend fake_nairobi --shots 4000
+
+The submissions are scored in parallel on AerSimulator (fully offline), optionally with the noise model of a fake
+backend. Each submission runs in its own spawned process, which is killed if it is still running after the
+per-submission timeout. The exact solution of each distinct Hamiltonian is computed within the timeout of the first
+submission solving it, and cached on disk for the other submissions of its group, which start once it has finished.
+The successfully graded submissions are ranked within the group of submissions solving the same Hamiltonian.
+"""
+import argparse
+import contextlib
+import csv
+import glob
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+from qiskit_aer import AerSimulator
+from qiskit_ibm_runtime.fake_provider import FakeProviderForBackendV2
+
+from problemes_utils import calc_score, hamiltonian_fingerprint, read_res
+
+# Columns of the leaderboard
+LEADERBOARD_FIELDS = ["hamiltonian", "rank", "file", "num_qubits", "num_layers", "cost", "score", "time_s", "status"]
+# Time (s) allowed for each submission by default
+DEFAULT_TIMEOUT = 600.0
+# Interval (s) between two checks of the running submissions
+POLL_INTERVAL = 0.05
+
+
+def grade_submission(
+    filename: str, mode: str, cache_dir: str, fake_backend: str | None = None, shots: int | None = None
+) -> dict:
+    """Scores a single submission on AerSimulator.
+
+    Args:
+        filename (str): Name of the file generated by save_res.
+        mode (str): Scoring mode of calc_score ("sampling" or "exact").
+        cache_dir (str): Directory where the exact solutions are cached.
+        fake_backend (str, optional): Name of the fake backend whose noise model is simulated (e.g. "fake_nairobi").
+            Defaults to None (noiseless AerSimulator).
+        shots (int, optional): Number of shots of calc_score. Defaults to None (defaults of the primitives).
+
+    Returns:
+        dict: Row of the leaderboard for this submission.
+    """
+    row = {"file": os.path.basename(filename), "status": "ok"}
+    start = time.perf_counter()
+    try:
+        params, num_layers, hamiltonian = read_res(filename)
+        row.update(num_qubits=hamiltonian.num_qubits, num_layers=num_layers)
+        backend = FakeProviderForBackendV2().backend(fake_backend) if fake_backend is not None else AerSimulator()
+        with contextlib.redirect_stdout(io.StringIO()):
+            cost, score = calc_score(
+                params, num_layers, hamiltonian, backend=backend, mode=mode, cache_dir=cache_dir, shots=shots
+            )
+        row.update(cost=float(cost), score=float(score))
+    except Exception as error:
+        row["status"] = f"error: {error}"
+    row["time_s"] = time.perf_counter() - start
+    return row
+
+
+def _grade_worker(connection, filename: str, mode: str, cache_dir: str, fake_backend: str | None, shots: int | None):
+    """Grades a submission in a worker process and sends its leaderboard row back through the connection."""
+    connection.send(grade_submission(filename, mode, cache_dir, fake_backend, shots))
+    connection.close()
+
+
+def grade_directory(
+    directory: str,
+    workers: int | None = None,
+    timeout: float | None = DEFAULT_TIMEOUT,
+    mode: str = "sampling",
+    fake_backend: str | None = None,
+    shots: int | None = None,
+) -> list[dict]:
+    """Grades every .npz submission of a directory, each in its own spawned worker process.
+
+    Args:
+        directory (str): Directory containing the files generated by save_res.
+        workers (int, optional): Number of submissions graded at once. Defaults to None (number of CPUs).
+        timeout (float, optional): Time (s) allowed for each submission, counted from the start of its process, after
+            which the process is killed and the submission reported as timed out. Defaults to DEFAULT_TIMEOUT.
+            None allows unlimited time.
+        mode (str, optional): Scoring mode of calc_score ("sampling" or "exact"). Defaults to "sampling".
+        fake_backend (str, optional): Name of the fake backend whose noise model is simulated in sampling mode.
+            Defaults to None (noiseless AerSimulator).
+        shots (int, optional): Number of shots of calc_score. Defaults to None (defaults of the primitives).
+
+    Returns:
+        list[dict]: Leaderboard rows, grouped by Hamiltonian fingerprint. The rows graded successfully come first in
+            their group, ranked by decreasing score then increasing cost; the others have no rank.
+    """
+    filenames = sorted(glob.glob(os.path.join(directory, "*.npz")))
+    workers = workers if workers is not None else os.cpu_count()
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # Group the submissions by Hamiltonian. The exact solutions are computed by the workers, within their timeout.
+        fingerprints: dict[str, str] = {}
+        groups: dict[str, list[str]] = {}
+        for filename in filenames:
+            try:
+                _, _, hamiltonian = read_res(filename)
+            except Exception:
+                # Unreadable submissions are reported by their worker
+                continue
+            key = hamiltonian_fingerprint(hamiltonian)
+            groups.setdefault(key, []).append(os.path.basename(filename))
+            fingerprints[filename] = key
+        for key, group in groups.items():
+            print(f"Hamiltonian {key[:12]} : {len(group)} submission(s)")
+        # Hamiltonians of which a submission has been graded, so that their exact solution is in the disk cache
+        solved: set[str] = set()
+
+        # Grade the submissions in spawned processes (forked ones can deadlock in Aer), a slow or hung submission only
+        # holds its own process until its timeout
+        context = multiprocessing.get_context("spawn")
+        rows = []
+        pending = list(filenames)
+        running: dict[str, tuple] = {}
+        while pending or running:
+            # Until a submission of a Hamiltonian has been graded, the others wait for it instead of computing the same
+            # exact solution at the same time; the submissions of other Hamiltonians start meanwhile
+            running_groups = {fingerprints.get(filename) for filename in running}
+            for filename in list(pending):
+                if len(running) >= workers:
+                    break
+                key = fingerprints.get(filename)
+                if key is not None and key not in solved and key in running_groups:
+                    continue
+                pending.remove(filename)
+                running_groups.add(key)
+                receiver, sender = context.Pipe(duplex=False)
+                process = context.Process(
+                    target=_grade_worker, args=(sender, filename, mode, cache_dir, fake_backend, shots), daemon=True
+                )
+                process.start()
+                sender.close()
+                running[filename] = (process, receiver, time.monotonic())
+
+            for filename, (process, receiver, start) in list(running.items()):
+                elapsed = time.monotonic() - start
+                if receiver.poll():
+                    try:
+                        row = receiver.recv()
+                    except EOFError:
+                        # The process ended without sending its row (e.g. killed by the system)
+                        row = {"file": os.path.basename(filename), "status": f"error: worker exited ({process.exitcode})"}
+                elif not process.is_alive():
+                    row = {"file": os.path.basename(filename), "status": f"error: worker exited ({process.exitcode})"}
+                elif timeout is not None and elapsed > timeout:
+                    process.terminate()
+                    row = {"file": os.path.basename(filename), "status": "timeout"}
+                else:
+                    continue
+                process.join()
+                receiver.close()
+                del running[filename]
+                row.setdefault("time_s", elapsed)
+                row["hamiltonian"] = fingerprints.get(filename)
+                if row["status"] == "ok":
+                    solved.add(row["hamiltonian"])
+                rows.append(row)
+            time.sleep(POLL_INTERVAL)
+
+    # Scores are only comparable between submissions solving the same Hamiltonian
+    rows.sort(
+        key=lambda row: (
+            row["hamiltonian"] is None,
+            row["hamiltonian"] or "",
+            row["status"] != "ok",
+            -row.get("score", -np.inf),
+            row.get("cost", np.inf),
+        )
+    )
+    ranks: dict[str | None, int] = {}
+    for row in rows:
+        if row["status"] != "ok":
+            # Failed submissions are listed without a rank
+            row["rank"] = None
+            continue
+        ranks[row["hamiltonian"]] = ranks.get(row["hamiltonian"], 0) + 1
+        row["rank"] = ranks[row["hamiltonian"]]
+    return rows
+
+
+def write_leaderboard(rows: list[dict], filename: str):
+    """Writes the leaderboard as a CSV file, or as a JSON file if the filename ends with .json.
+
+    Args:
+        rows (list[dict]): Leaderboard rows returned by grade_directory.
+        filename (str): Name of the leaderboard file.
+    """
+    if filename.endswith(".json"):
+        with open(filename, "w") as file:
+            json.dump(rows, file, indent=2)
+        return
+
+    with open(filename, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=LEADERBOARD_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grades a directory of QAOA submissions and writes a leaderboard.")
+    parser.add_argument("directory", help="Directory containing the .npz files generated by save_res.")
+    parser.add_argument("--output", default="leaderboard.csv", help="Leaderboard file (.csv or .json).")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: all CPUs).")
+    parser.add_argument(
+        "--timeout", type=float, default=DEFAULT_TIMEOUT, help=f"Time (s) allowed for each submission (default: {DEFAULT_TIMEOUT})."
+    )
+    parser.add_argument("--mode", choices=["sampling", "exact"], default="sampling", help="Scoring mode of calc_score.")
+    parser.add_argument("--fake-backend", default=None, help="Fake backend whose noise is simulated, e.g. fake_nairobi.")
+    parser.add_argument("--shots", type=int, default=None, help="Number of shots of the Sampler and the Estimator.")
+    args = parser.parse_args()
+
+    rows = grade_directory(
+        args.directory,
+        workers=args.workers,
+        timeout=args.timeout,
+        mode=args.mode,
+        fake_backend=args.fake_backend,
+        shots=args.shots,
+    )
+    write_leaderboard(rows, args.output)
+    for row in rows:
+        group = row["hamiltonian"][:12] if row["hamiltonian"] is not None else "unreadable"
+        rank = f"{row['rank']:>3}." if row["rank"] is not None else "   -"
+        print(f"{group} {rank} {row['file']} : score {row.get('score', '-')}, cost {row.get('cost', '-')} ({row['status']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,89 +1,1320 @@
+import hashlib
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from multiprocessing.pool import Pool
+
 import numpy as np
+from scipy.optimize import OptimizeResult, minimize
+from scipy.stats import qmc
+from scipy.sparse.linalg import ArpackNoConvergence, LinearOperator, eigsh
+from scipy.special import logsumexp
 
-from qiskit.quantum_info import SparsePauliOp
+from qiskit import QuantumCircuit
+from qiskit.quantum_info import PauliList, SparsePauliOp, Statevector
+from qiskit.circuit import ParameterVector
+from qiskit.primitives import BitArray
 from qiskit.circuit.library import QAOAAnsatz
 from qiskit.providers import BackendV2 as Backend
 from qiskit_ibm_runtime import SamplerV2 as Sampler
 from qiskit_ibm_runtime import EstimatorV2 as Estimator
+from qiskit_ibm_runtime.fake_provider.fake_backend import FakeBackendV2
 from qiskit_aer import AerSimulator
 from qiskit.transpiler.preset_passmanagers import generate_preset_pass_manager
 
+from qaoa_profiler import count, phase, record_circuit
+
+# Largest number of qubits for which non-diagonal Hamiltonians are diagonalized as dense matrices
+DENSE_MAX_QUBITS = 10
+# Number of eigenpairs requested at once from the sparse eigensolver
+SPARSE_NUM_EIGS = 6
+# Largest number of deflation rounds of the sparse eigensolver, i.e. about SPARSE_NUM_EIGS * 16 degenerate ground states
+SPARSE_MAX_ROUNDS = 16
+# Largest number of qubits for which the sparse eigensolver falls back to a dense diagonalization when it fails
+DENSE_FALLBACK_MAX_QUBITS = 12
+# Rotation gates exp(-iθP/2) to which the parameter-shift rule applies
+SHIFT_RULE_GATES = {"rx", "ry", "rz", "rxx", "ryy", "rzz", "rzx", "p"}
+# Largest number of qubits for which the cost of every basis state is tabulated by QAOASampledCost
+COST_TABLE_MAX_QUBITS = 24
+# Version of the layout of the files written by save_res
+RES_FORMAT_VERSION = 1
+
+
+def is_diagonal(hamiltonian: SparsePauliOp) -> bool:
+    """Checks if the inputted Hamiltonian is diagonal in the computational basis, i.e. only made of I and Z Pauli operators.
+
+    Args:
+        hamiltonian (SparsePauliOp): Hamiltonian expressed as a sum of Pauli strings.
+
+    Returns:
+        bool: True if no Pauli string of the Hamiltonian contains an X or Y operator.
+    """
+    return not np.any(hamiltonian.paulis.x)
+
+
+def _pauli_z_masks(hamiltonian: SparsePauliOp) -> np.ndarray:
+    """Integer masks of the qubits acted upon by each Pauli string (bit j set if qubit j carries a Z)."""
+    weights = np.left_shift(1, np.arange(hamiltonian.num_qubits, dtype=np.int64))
+    return hamiltonian.paulis.z.astype(np.int64) @ weights
+
+
+def _parity(values: np.ndarray) -> np.ndarray:
+    """In-place parity (0 or 1) of the number of set bits of each integer of the array."""
+    for shift in (32, 16, 8, 4, 2, 1):
+        values ^= values >> shift
+    values &= 1
+    return values
+
+
+def _diagonal_at(z_masks: np.ndarray, coeffs: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """Diagonal elements at the inputted indices of the Hamiltonian described by its Pauli-Z masks and real coefficients."""
+    parity = np.empty_like(indices)
+    diagonal = np.zeros(indices.size)
+    for mask, coeff in zip(z_masks, coeffs):
+        # Each Pauli string contributes +coeff for even parity and -coeff for odd parity
+        _parity(np.bitwise_and(indices, mask, out=parity))
+        diagonal += coeff
+        diagonal -= (2 * coeff) * parity
+
+    return diagonal
+
+
+def _diagonal_block(z_masks: np.ndarray, coeffs: np.ndarray, start: int, stop: int) -> np.ndarray:
+    """Diagonal elements start to stop (excluded) of the Hamiltonian described by its Pauli-Z masks and real coefficients."""
+    return _diagonal_at(z_masks, coeffs, np.arange(start, stop, dtype=np.int64))
+
+
+def _block_minimum(task: tuple[np.ndarray, np.ndarray, int, int, float]) -> tuple[float, np.ndarray, np.ndarray]:
+    """Minimal cost of a block of basis states, with the indices and costs of the basis states within atol of it."""
+    z_masks, coeffs, start, stop, atol = task
+    diagonal = _diagonal_block(z_masks, coeffs, start, stop)
+    min_cost = diagonal.min()
+    min_indices = np.flatnonzero(diagonal <= min_cost + atol)
+    return min_cost, start + min_indices, diagonal[min_indices]
+
+
+def compute_diagonal(hamiltonian: SparsePauliOp) -> np.ndarray:
+    """Classical computation of the diagonal of a Hamiltonian made only of I and Z Pauli operators.
+        Each Pauli string contributes +coeff or -coeff to a basis state, depending on the parity of the bits
+        of the basis state on which the Pauli string acts. The full matrix is never built.
+
+    Args:
+        hamiltonian (SparsePauliOp): Diagonal Hamiltonian, expressed as a sum of I and Z Pauli strings.
+
+    Returns:
+        np.ndarray: Cost of each of the 2^n basis states, indexed as in Qiskit (qubit 0 is the least significant bit).
+    """
+    if not is_diagonal(hamiltonian):
+        raise ValueError("The Hamiltonian contains X or Y Pauli operators and is not diagonal.")
+
+    return _diagonal_block(_pauli_z_masks(hamiltonian), hamiltonian.coeffs.real, 0, 2**hamiltonian.num_qubits)
+
+
+def evaluate_costs(hamiltonian: SparsePauliOp, indices: np.ndarray) -> np.ndarray:
+    """Classical computation of the cost of some basis states for a Hamiltonian made only of I and Z Pauli operators.
+
+    Args:
+        hamiltonian (SparsePauliOp): Diagonal Hamiltonian, expressed as a sum of I and Z Pauli strings.
+        indices (np.ndarray): Integer indices of the basis states (qubit 0 is the least significant bit).
+
+    Returns:
+        np.ndarray: Cost of each basis state.
+    """
+    if not is_diagonal(hamiltonian):
+        raise ValueError("The Hamiltonian contains X or Y Pauli operators and is not diagonal.")
+
+    indices = np.asarray(indices, dtype=np.int64)
+    return _diagonal_at(_pauli_z_masks(hamiltonian), hamiltonian.coeffs.real, indices.ravel()).reshape(indices.shape)
+
+
+def compute_exact_sol_by_blocks(
+    hamiltonian: SparsePauliOp, block_size: int = 2**20, pool: Pool | None = None, atol: float = 1e-8
+) -> tuple[float, list[str]]:
+    """Classical computation of the solutions of a Hamiltonian made only of I and Z Pauli operators, with bounded memory.
+        The basis states are visited by blocks of 'block_size' states, keeping only a running minimum and
+        the basis states reaching it. The full 2^n diagonal is never stored.
+
+    Args:
+        hamiltonian (SparsePauliOp): Diagonal Hamiltonian, expressed as a sum of I and Z Pauli strings.
+        block_size (int, optional): Number of basis states evaluated at once. Defaults to 2**20.
+        pool (Pool, optional): Multiprocessing pool used to evaluate the blocks in parallel. Defaults to None (serial).
+        atol (float, optional): Tolerance under which two costs are considered degenerate. Defaults to 1e-8.
+
+    Returns:
+        tuple[float, list[str]]:
+            - minimal cost obtained (float)
+            - List of the binary solutions associated to the minimal cost
+    """
+    if not is_diagonal(hamiltonian):
+        raise ValueError("The Hamiltonian contains X or Y Pauli operators and is not diagonal.")
+
+    z_masks = _pauli_z_masks(hamiltonian)
+    coeffs = hamiltonian.coeffs.real
+    dimension = 2**hamiltonian.num_qubits
+    tasks = (
+        (z_masks, coeffs, start, min(start + block_size, dimension), atol) for start in range(0, dimension, block_size)
+    )
+    block_results = map(_block_minimum, tasks) if pool is None else pool.imap(_block_minimum, tasks)
+
+    # Running minimum over the blocks, along with every basis state within atol of it
+    min_cost = np.inf
+    min_indices = np.empty(0, dtype=np.int64)
+    min_costs = np.empty(0)
+    for block_min, block_indices, block_costs in block_results:
+        min_cost = min(min_cost, block_min)
+        min_indices = np.concatenate([min_indices, block_indices])
+        min_costs = np.concatenate([min_costs, block_costs])
+        is_min = min_costs <= min_cost + atol
+        min_indices, min_costs = min_indices[is_min], min_costs[is_min]
+
+    binary_sols = [bin(idx).lstrip("-0b").zfill(hamiltonian.num_qubits) for idx in min_indices]
+    return float(min_cost), binary_sols
+
+
+def _ground_space(hamiltonian: SparsePauliOp, method: str, atol: float) -> tuple[float, np.ndarray]:
+    """Minimal eigenvalue of a Hermitian Hamiltonian and an orthonormal basis of its (possibly degenerate) ground space.
+
+    Args:
+        hamiltonian (SparsePauliOp): Hermitian Hamiltonian, expressed as a sum of Pauli strings.
+        method (str): "dense" to diagonalize the full matrix with eigh, "sparse" to use the Lanczos solver eigsh.
+        atol (float): Tolerance under which two eigenvalues are considered degenerate.
+
+    Returns:
+        tuple[float, np.ndarray]: Minimal eigenvalue and the eigenvectors (as columns) associated to it.
+
+    Raises:
+        RuntimeError: If the sparse solver does not converge or the ground space is too degenerate for it (more than
+            SPARSE_MAX_ROUNDS deflation rounds), on more than DENSE_FALLBACK_MAX_QUBITS qubits.
+    """
+    dimension = 2**hamiltonian.num_qubits
+    if method == "dense" or dimension <= SPARSE_NUM_EIGS + 1:
+        eigenvalues, eigenvects = np.linalg.eigh(hamiltonian.to_matrix())
+        return eigenvalues[0], eigenvects[:, eigenvalues <= eigenvalues[0] + atol]
+
+    try:
+        return _sparse_ground_space(hamiltonian, atol)
+    except (ArpackNoConvergence, RuntimeError) as error:
+        if hamiltonian.num_qubits > DENSE_FALLBACK_MAX_QUBITS:
+            raise RuntimeError(
+                f"The sparse eigensolver failed on {hamiltonian.num_qubits} qubits ({error}), which is too large for a "
+                f"dense diagonalization (at most {DENSE_FALLBACK_MAX_QUBITS} qubits)."
+            ) from error
+        return _ground_space(hamiltonian, "dense", atol)
+
+
+def _sparse_ground_space(hamiltonian: SparsePauliOp, atol: float) -> tuple[float, np.ndarray]:
+    """Sparse (eigsh) part of _ground_space, raising RuntimeError after SPARSE_MAX_ROUNDS deflation rounds."""
+    dimension = 2**hamiltonian.num_qubits
+
+    mat_hamiltonian = hamiltonian.to_matrix(sparse=True)
+    # Shift larger than the spectral width, used to push the eigenvectors already found out of the lowest eigenvalues
+    shift = 2 * np.sum(np.abs(hamiltonian.coeffs))
+    min_eigenval, ground_space = np.inf, np.empty((dimension, 0), dtype=complex)
+
+    # Lanczos can miss degenerate eigenvectors, so the ground space found so far is deflated and the search restarted
+    # until no new eigenvector of the ground space comes up
+    for _ in range(SPARSE_MAX_ROUNDS):
+        if ground_space.shape[1] >= dimension - 1:
+            break
+        found = ground_space
+        deflated_hamiltonian = LinearOperator(
+            shape=mat_hamiltonian.shape,
+            matvec=lambda vec: mat_hamiltonian @ vec + shift * (found @ (found.conj().T @ vec)),
+            dtype=complex,
+        )
+        num_eigs = min(SPARSE_NUM_EIGS, dimension - 2 - ground_space.shape[1])
+        eigenvalues, eigenvects = eigsh(deflated_hamiltonian, k=max(num_eigs, 1), which="SA")
+
+        min_eigenval = min(min_eigenval, eigenvalues.min())
+        is_ground = eigenvalues <= min_eigenval + atol
+        ground_space = np.hstack([ground_space, eigenvects[:, is_ground]])
+        if not np.any(is_ground):
+            break
+    else:
+        raise RuntimeError(f"Ground space still growing after {SPARSE_MAX_ROUNDS} deflation rounds.")
+
+    # Vectors found by successive searches are only orthogonal up to the solver's precision
+    return min_eigenval, np.linalg.qr(ground_space)[0]
+
+
+def has_z2_symmetry(hamiltonian: SparsePauliOp) -> bool:
+    """Checks if the cost of the inputted Hamiltonian is unchanged when every bit is flipped (e.g. MaxCut Hamiltonians),
+    i.e. if it is diagonal and each of its Pauli strings contains an even number of Z operators.
+
+    Args:
+        hamiltonian (SparsePauliOp): Hamiltonian expressed as a sum of Pauli strings.
+
+    Returns:
+        bool: True if the Hamiltonian has the global bit-flip symmetry.
+    """
+    return is_diagonal(hamiltonian) and not np.any(np.sum(hamiltonian.paulis.z, axis=1) % 2)
+
+
+def reduce_z2_symmetry(hamiltonian: SparsePauliOp, qubit: int | None = None) -> SparsePauliOp:
+    """Reduces a Hamiltonian with the global bit-flip symmetry to one qubit less, by fixing the bit of one qubit to 0.
+    The Z operators acting on this qubit are then replaced by their eigenvalue +1 (identity).
+    Each solution of the reduced Hamiltonian gives two solutions of the full one (see expand_z2_solutions).
+
+    Args:
+        hamiltonian (SparsePauliOp): Hamiltonian with the global bit-flip symmetry (see has_z2_symmetry).
+        qubit (int, optional): Qubit whose bit is fixed to 0. Defaults to None (last qubit).
+
+    Returns:
+        SparsePauliOp: Reduced Hamiltonian, acting on the other qubits (in the same order).
+    """
+    if not has_z2_symmetry(hamiltonian):
+        raise ValueError("The Hamiltonian does not have the global bit-flip symmetry.")
+    if qubit is None:
+        qubit = hamiltonian.num_qubits - 1
+
+    z = np.delete(hamiltonian.paulis.z, qubit, axis=1)
+    return SparsePauliOp(PauliList.from_symplectic(z, np.zeros_like(z)), hamiltonian.coeffs)
+
+
+def expand_z2_solutions(binary_sols: list[str], qubit: int | None = None) -> list[str]:
+    """Maps the binary solutions of a Hamiltonian reduced by reduce_z2_symmetry back to the full Hamiltonian.
+    Each reduced solution gives the full solution with the fixed bit set to 0, and its bit-flipped copy.
+
+    Args:
+        binary_sols (list[str]): Binary solutions of the reduced Hamiltonian.
+        qubit (int, optional): Qubit whose bit was fixed to 0. Defaults to None (last qubit).
+
+    Returns:
+        list[str]: Sorted binary solutions of the full Hamiltonian.
+    """
+    full_sols = []
+    for sol in binary_sols:
+        # Bitstrings are read right to left, from qubit 0
+        position = 0 if qubit is None else len(sol) - qubit
+        full_sol = sol[:position] + "0" + sol[position:]
+        full_sols += [full_sol, full_sol.translate(str.maketrans("01", "10"))]
+    return sorted(full_sols)
 
-def compute_exact_sol(hamiltonian: SparsePauliOp) -> tuple[float, list[str]]:
+
+def compute_exact_sol(
+    hamiltonian: SparsePauliOp,
+    block_size: int = 2**20,
+    pool: Pool | None = None,
+    method: str = "auto",
+    atol: float = 1e-8,
+    use_symmetry: bool = True,
+) -> tuple[float, list[str]]:
     """ Classical computation of the inputted Hamiltonian's solutions.
-        Done by diagonalizing the Hamiltonian's matrix representation.
+        Done by diagonalizing the Hamiltonian's matrix representation. Hamiltonians made only of I and Z
+        Pauli operators are already diagonal, so their diagonal is directly evaluated by blocks instead
+        (see compute_exact_sol_by_blocks). If they also have the global bit-flip symmetry, only half
+        of the basis states are evaluated (see reduce_z2_symmetry).
+
+        For non-diagonal Hamiltonians, the binary solutions are the basis states with the largest weight
+        in the ground space of the Hamiltonian.
 
     Args:
         Hamiltonian (SparsePauliOp): Hamiltonian to diagonalize, expressed as a sum of Pauli strings.
+        block_size (int, optional): Number of basis states evaluated at once for diagonal Hamiltonians. Defaults to 2**20.
+        pool (Pool, optional): Multiprocessing pool used to evaluate the blocks of diagonal Hamiltonians. Defaults to None.
+        method (str, optional): "diagonal", "dense" (eigh on the full matrix), "sparse" (eigsh on the sparse matrix) or
+            "auto", which picks "diagonal" if possible, else "dense" up to DENSE_MAX_QUBITS qubits and "sparse" beyond.
+            "sparse" falls back to "dense" up to DENSE_FALLBACK_MAX_QUBITS qubits if the solver fails (e.g. on very
+            degenerate ground spaces), and raises a RuntimeError beyond. Defaults to "auto".
+        atol (float, optional): Tolerance under which two costs are considered degenerate. Defaults to 1e-8.
+        use_symmetry (bool, optional): Use the global bit-flip symmetry of diagonal Hamiltonians. Defaults to True.
 
     Returns:
         tuple[float, list[str]]:
             - minimal cost obtained (float)
             - List of the binary solutions associated to the minimal cost
     """
-    # Write the Hamiltonian as a matrix
-    mat_hamiltonian = np.array(hamiltonian.to_matrix())
-    # Diagonalize the matrix to extract the eigenvectors and eigenvalues
-    eigenvalues, eigenvects = np.linalg.eig(mat_hamiltonian)
+    if method == "auto":
+        if is_diagonal(hamiltonian):
+            method = "diagonal"
+        else:
+            method = "dense" if hamiltonian.num_qubits <= DENSE_MAX_QUBITS else "sparse"
 
-    # Indices associated to the minimal eigenvalues
-    min_eigenval = np.where(eigenvalues == np.min(eigenvalues))[0]
-    # Minimal solutions associated to the minimal eigenvalues
-    binary_sols = [bin(idx).lstrip("-0b").zfill(hamiltonian.num_qubits) for idx in min_eigenval]
+    if method == "diagonal":
+        # The eigenvalues are the diagonal elements, and the eigenvectors are the computational basis states
+        if use_symmetry and hamiltonian.num_qubits > 1 and has_z2_symmetry(hamiltonian):
+            min_cost, binary_sols = compute_exact_sol_by_blocks(
+                reduce_z2_symmetry(hamiltonian), block_size=block_size, pool=pool, atol=atol
+            )
+            return min_cost, expand_z2_solutions(binary_sols)
+        return compute_exact_sol_by_blocks(hamiltonian, block_size=block_size, pool=pool, atol=atol)
+    if method not in ("dense", "sparse"):
+        raise ValueError(f"Unknown method '{method}', expected 'auto', 'diagonal', 'dense' or 'sparse'.")
+
+    # Diagonalize the Hermitian matrix to extract the minimal eigenvalue and its eigenvectors
+    min_eigenval, ground_space = _ground_space(hamiltonian, method, atol)
+
+    # Minimal solutions are the basis states with the largest weight in the ground space
+    weights = np.sum(np.abs(ground_space) ** 2, axis=1)
+    min_indices = np.flatnonzero(np.isclose(weights, weights.max()))
+    binary_sols = [bin(idx).lstrip("-0b").zfill(hamiltonian.num_qubits) for idx in min_indices]
 
     # Cost and binary strings of the best solutions
-    return eigenvalues[min_eigenval][0].real, binary_sols
+    return float(min_eigenval), binary_sols
+
+
+def hamiltonian_fingerprint(hamiltonian: SparsePauliOp) -> str:
+    """Content hash of a Hamiltonian, independent of the order and repetition of its Pauli strings.
+
+    Args:
+        hamiltonian (SparsePauliOp): Hamiltonian expressed as a sum of Pauli strings.
+
+    Returns:
+        str: SHA-256 hex digest of the sorted Pauli labels and coefficients of the simplified Hamiltonian.
+    """
+    terms = sorted(hamiltonian.simplify(atol=0).to_list())
+    digest = hashlib.sha256(str(hamiltonian.num_qubits).encode())
+    for label, coeff in terms:
+        digest.update(label.encode())
+        digest.update(np.complex128(coeff).tobytes())
+    return digest.hexdigest()
+
+
+# In-memory cache of the exact solutions, from the Hamiltonian fingerprint and options to (minimal cost, binary solutions)
+_EXACT_SOL_CACHE: OrderedDict[str, tuple[float, list[str]]] = OrderedDict()
+# Number of Hamiltonians kept in the in-memory cache
+EXACT_SOL_CACHE_SIZE = 32
+# Arguments of compute_exact_sol that only change how the solutions are computed, left out of the cache keys
+EXACT_SOL_EXECUTION_ARGS = ("block_size", "pool")
+# Number of transpiled QAOA circuits kept in the in-memory cache
+TRANSPILE_CACHE_SIZE = 64
+# Largest number of qubits for which noisy simulations use the density-matrix method instead of trajectories
+DENSITY_MATRIX_MAX_QUBITS = 12
+
+
+def compute_exact_sol_cached(
+    hamiltonian: SparsePauliOp, cache_dir: str | None = None, **kwargs
+) -> tuple[float, list[str]]:
+    """Memoized version of compute_exact_sol, keyed by the fingerprint of the Hamiltonian and the sorted keyword
+    arguments that change the solutions (all but EXACT_SOL_EXECUTION_ARGS, e.g. method or atol).
+    The solutions are looked up in an in-memory LRU cache, then in the optional on-disk cache directory,
+    and only computed if both miss.
+
+    Args:
+        hamiltonian (SparsePauliOp): Hamiltonian to diagonalize, expressed as a sum of Pauli strings.
+        cache_dir (str, optional): Directory of .npz files storing the solutions on disk. Defaults to None (memory only).
+        **kwargs: Keyword arguments passed to compute_exact_sol on a cache miss.
+
+    Returns:
+        tuple[float, list[str]]:
+            - minimal cost obtained (float)
+            - List of the binary solutions associated to the minimal cost
+    """
+    options = sorted((name, value) for name, value in kwargs.items() if name not in EXACT_SOL_EXECUTION_ARGS)
+    key = hamiltonian_fingerprint(hamiltonian) + "".join(f"_{name}={value}" for name, value in options)
+    if key in _EXACT_SOL_CACHE:
+        _EXACT_SOL_CACHE.move_to_end(key)
+        min_cost, binary_sols = _EXACT_SOL_CACHE[key]
+        return min_cost, list(binary_sols)
+
+    path = os.path.join(cache_dir, f"{key}.npz") if cache_dir is not None else None
+    if path is not None and os.path.exists(path):
+        with np.load(path) as file:
+            min_cost, binary_sols = float(file["min_cost"]), file["binary_sols"].tolist()
+    else:
+        min_cost, binary_sols = compute_exact_sol(hamiltonian, **kwargs)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez(path, min_cost=min_cost, binary_sols=np.array(binary_sols, dtype=f"U{hamiltonian.num_qubits}"))
+
+    _EXACT_SOL_CACHE[key] = (min_cost, list(binary_sols))
+    if len(_EXACT_SOL_CACHE) > EXACT_SOL_CACHE_SIZE:
+        _EXACT_SOL_CACHE.popitem(last=False)
+    return min_cost, binary_sols
+
+
+# AerSimulators reproducing the noise of fake backends, from (backend name, simulation method) to the simulator
+_NOISY_SIMULATORS: dict[tuple[str, str], AerSimulator] = {}
+
+
+def noisy_simulator(backend: Backend, num_qubits: int, method: str | None = None) -> Backend:
+    """AerSimulator with the noise model and target of a fake backend (e.g. FakeNairobiV2), built once per backend.
+    Other backends (AerSimulator, real devices) are returned unchanged.
+
+    Args:
+        backend (Backend): Backend on which the circuits are meant to run.
+        num_qubits (int): Number of qubits of the simulated circuits.
+        method (str, optional): Simulation method of the noisy AerSimulator. Defaults to None: "density_matrix" (exact
+            noisy state, then sampled) up to DENSITY_MATRIX_MAX_QUBITS qubits, else "statevector" (one noisy
+            trajectory per shot).
+
+    Returns:
+        Backend: Backend to instanciate the Estimator or Sampler with.
+    """
+    if not isinstance(backend, FakeBackendV2):
+        return backend
+    if method is None:
+        method = "density_matrix" if num_qubits <= DENSITY_MATRIX_MAX_QUBITS else "statevector"
+    key = (backend.name, method)
+    if key not in _NOISY_SIMULATORS:
+        _NOISY_SIMULATORS[key] = AerSimulator.from_backend(backend, method=method)
+    return _NOISY_SIMULATORS[key]
+
+
+def _backend_key(backend: Backend) -> tuple:
+    """Identifies the target of a backend, on which the transpiled circuits depend."""
+    coupling_map = backend.coupling_map
+    edges = tuple(sorted(coupling_map.get_edges())) if coupling_map is not None else None
+    return backend.name, backend.num_qubits, tuple(sorted(backend.operation_names)), edges
+
+
+# In-memory caches of the pass managers, from (backend, optimization level), and of the transpiled QAOA circuits, from
+# (backend, number of layers, Hamiltonian terms, optimization level, measured) to (ISA circuit, laid out observable)
+_PASS_MANAGER_CACHE: dict[tuple, object] = {}
+_TRANSPILE_CACHE: OrderedDict[tuple, tuple[QuantumCircuit, SparsePauliOp]] = OrderedDict()
+
+
+def transpile_qaoa(
+    hamiltonian: SparsePauliOp, num_layers: int, backend: Backend, optimization_level: int = 1, measure: bool = False
+) -> tuple[QuantumCircuit, SparsePauliOp]:
+    """Builds and transpiles the QAOA circuit of a Hamiltonian for a backend, and lays out the Hamiltonian accordingly.
+    The pass manager and the transpiled circuit are cached per backend, number of layers and Hamiltonian, so scoring or
+    optimizing the same problem again does not transpile it again. The Hamiltonian is identified by its ordered Pauli
+    labels and coefficients rather than by hamiltonian_fingerprint, since the QAOA circuit depends on the order of
+    non-commuting terms.
+
+    Args:
+        hamiltonian (SparsePauliOp): Problem hamiltonian expressed as a sum of Pauli strings (cost function)
+        num_layers (int): Number of layers in the QAOA circuit.
+        backend (Backend): Backend whose target the circuit is transpiled for.
+        optimization_level (int, optional): Optimization level of the transpilation. Defaults to 1.
+        measure (bool, optional): Measure all the qubits at the end of the circuit, for a Sampler. Defaults to False.
+
+    Returns:
+        tuple[QuantumCircuit, SparsePauliOp]: Transpiled (ISA) circuit and Hamiltonian laid out on its qubits.
+            The circuit is shared with the cache and must not be modified.
+    """
+    backend_key = _backend_key(backend)
+    key = (backend_key, num_layers, tuple(hamiltonian.to_list()), optimization_level, measure)
+    if key in _TRANSPILE_CACHE:
+        _TRANSPILE_CACHE.move_to_end(key)
+        count("transpile_cache_hits")
+        return _TRANSPILE_CACHE[key]
+
+    with phase("ansatz", num_layers=num_layers):
+        circuit = QAOAAnsatz(hamiltonian, reps=num_layers)
+        if measure:
+            circuit.measure_all()
+    if (backend_key, optimization_level) not in _PASS_MANAGER_CACHE:
+        with phase("pass_manager"):
+            _PASS_MANAGER_CACHE[backend_key, optimization_level] = generate_preset_pass_manager(
+                backend=backend, optimization_level=optimization_level
+            )
+    with phase("transpile", num_layers=num_layers):
+        isa_circuit = _PASS_MANAGER_CACHE[backend_key, optimization_level].run(circuit)
+    record_circuit(f"isa_{'measured_' if measure else ''}circuit_p{num_layers}", isa_circuit)
+    isa_observable = hamiltonian.apply_layout(isa_circuit.layout)
+
+    _TRANSPILE_CACHE[key] = (isa_circuit, isa_observable)
+    if len(_TRANSPILE_CACHE) > TRANSPILE_CACHE_SIZE:
+        _TRANSPILE_CACHE.popitem(last=False)
+    return isa_circuit, isa_observable
+
+
+def clear_caches():
+    """Empties the in-memory caches of the exact solutions, pass managers and transpiled circuits
+    (e.g. to time a workflow from a cold start)."""
+    _EXACT_SOL_CACHE.clear()
+    _PASS_MANAGER_CACHE.clear()
+    _TRANSPILE_CACHE.clear()
+
+
+class QAOACostFunction:
+    """Cost function of a QAOA circuit, to be minimized with scipy.optimize.minimize.
+    The QAOA circuit is transpiled and the Hamiltonian laid out only once per backend (see transpile_qaoa).
+    Each call then only binds the parameters and runs the Estimator.
+
+    Args:
+        hamiltonian (SparsePauliOp): Problem hamiltonian expressed as a sum of Pauli strings (cost function)
+        num_layers (int): Number of layers in the QAOA circuit.
+        backend (Backend): Backend used to instanciate the Estimator and transpile the circuit. Fake backends
+            (e.g. FakeNairobiV2) are simulated with their noise model (see noisy_simulator).
+        optimization_level (int, optional): Optimization level of the transpilation. Defaults to 1.
+        shots (int, optional): Number of shots per estimation. Defaults to None (default precision of the Estimator).
+        simulation_method (str, optional): Simulation method of fake backends. Defaults to None (see noisy_simulator).
+    """
+
+    def __init__(
+        self,
+        hamiltonian: SparsePauliOp,
+        num_layers: int,
+        backend: Backend,
+        optimization_level: int = 1,
+        shots: int | None = None,
+        simulation_method: str | None = None,
+    ):
+        self.hamiltonian = hamiltonian
+        self.num_layers = num_layers
+        self.estimator = Estimator(mode=noisy_simulator(backend, hamiltonian.num_qubits, simulation_method))
+        if shots is not None:
+            self.estimator.options.default_shots = shots
+
+        # Transpile the circuit and lay out the observable once for all the optimization
+        self.isa_circuit, self.isa_observable = transpile_qaoa(hamiltonian, num_layers, backend, optimization_level)
+
+        # Number of calls to the Estimator
+        self.num_evals = 0
+
+    @property
+    def num_parameters(self) -> int:
+        """Number of parameters of the QAOA circuit."""
+        return self.isa_circuit.num_parameters
+
+    def __call__(self, params: np.ndarray) -> float:
+        """Computes the average value of the Hamiltonian for the QAOA circuit with the inputted parameters.
+
+        Args:
+            params (np.ndarray): Parameters to be inserted in the QAOA circuit.
+
+        Returns:
+            float: Cost associated to the input parameters.
+        """
+        self.num_evals += 1
+        count("estimator_calls")
+        with phase("estimation"):
+            job = self.estimator.run([(self.isa_circuit, self.isa_observable, params)])
+            return float(job.result()[0].data.evs)
+
+    def evaluate_batch(self, params: np.ndarray) -> np.ndarray:
+        """Computes the average value of the Hamiltonian for many sets of parameters, submitted as a single Estimator PUB.
+
+        Args:
+            params (np.ndarray): Array of shape (..., num_parameters), each row being a set of parameters.
+
+        Returns:
+            np.ndarray: Costs associated to each set of parameters, of shape params.shape[:-1].
+        """
+        self.num_evals += 1
+        count("estimator_calls")
+        with phase("estimation", batch_size=int(np.prod(np.shape(params)[:-1]))):
+            job = self.estimator.run([(self.isa_circuit, self.isa_observable, np.asarray(params))])
+            return job.result()[0].data.evs
+
+    def _build_shift_circuit(self):
+        """Copy of the transpiled circuit where every parameterized gate has its own angle θ_k = A_k · params + b_k,
+        so that each gate can be shifted independently by the parameter-shift rule."""
+        shift_circuit = self.isa_circuit.copy_empty_like()
+        shift_circuit.global_phase = 0.0
+        angles = ParameterVector("θ", sum(1 for instruction in self.isa_circuit.data if instruction.operation.is_parameterized()))
+        jacobian = np.zeros((len(angles), self.num_parameters))
+        offsets = np.zeros(len(angles))
+
+        k = 0
+        for instruction in self.isa_circuit.data:
+            operation = instruction.operation
+            if operation.is_parameterized():
+                if operation.name not in SHIFT_RULE_GATES or len(operation.params) != 1:
+                    raise ValueError(f"The parameter-shift rule does not apply to the gate '{operation.name}'.")
+                # Angle of the gate as an affine function of the parameters of the QAOA circuit
+                expression = operation.params[0]
+                for i, parameter in enumerate(self.isa_circuit.parameters):
+                    if parameter in expression.parameters:
+                        jacobian[k, i] = float(expression.gradient(parameter))
+                offsets[k] = float(expression.bind({parameter: 0.0 for parameter in expression.parameters}))
+
+                operation = operation.to_mutable()
+                operation.params = [angles[k]]
+                k += 1
+            shift_circuit.append(operation, instruction.qubits, instruction.clbits)
+
+        self._shift_circuit, self._shift_jacobian, self._shift_offsets = shift_circuit, jacobian, offsets
+
+    def value_and_grad(self, params: np.ndarray) -> tuple[float, np.ndarray]:
+        """Computes the average value of the Hamiltonian and its gradient with the parameter-shift rule.
+        The parameters of QAOA circuits are shared by many gates, so each gate is shifted by ±π/2 separately and the
+        contributions are summed with the chain rule. The unshifted circuit and all the shifted ones are submitted
+        as a single Estimator PUB.
+
+        Args:
+            params (np.ndarray): Parameters to be inserted in the QAOA circuit.
+
+        Returns:
+            tuple[float, np.ndarray]: Cost associated to the input parameters and its gradient.
+        """
+        if not hasattr(self, "_shift_circuit"):
+            self._build_shift_circuit()
+
+        angles = self._shift_jacobian @ np.asarray(params, dtype=float) + self._shift_offsets
+        shifts = np.pi / 2 * np.eye(angles.size)
+        # Rows: unshifted angles, then every angle shifted by +π/2, then every angle shifted by -π/2
+        angles_batch = np.vstack([angles, angles + shifts, angles - shifts])
+
+        self.num_evals += 1
+        count("estimator_calls")
+        with phase("estimation", batch_size=len(angles_batch)):
+            job = self.estimator.run([(self._shift_circuit, self.isa_observable, angles_batch)])
+            evs = job.result()[0].data.evs
+
+        angles_grad = (evs[1 : angles.size + 1] - evs[angles.size + 1 :]) / 2
+        return float(evs[0]), self._shift_jacobian.T @ angles_grad
+
+
+def _bitarray_to_ints(bit_array: BitArray) -> np.ndarray:
+    """Index of the basis state measured at each shot of a BitArray (qubit 0 is the least significant bit)."""
+    # The bits of each shot are stored as big-endian bytes
+    byte_shifts = 8 * np.arange(bit_array.array.shape[-1] - 1, -1, -1, dtype=np.int64)
+    return np.bitwise_or.reduce(bit_array.array.astype(np.int64) << byte_shifts, axis=-1)
+
+
+def cvar_objective(costs: np.ndarray, alpha: float = 0.1) -> float:
+    """Conditional Value at Risk (Barkoutsos et al., 2020): average of the alpha fraction of lowest sampled costs.
+
+    Args:
+        costs (np.ndarray): Cost of each sampled basis state.
+        alpha (float, optional): Fraction of the samples kept, in (0, 1]. Defaults to 0.1.
+
+    Returns:
+        float: CVaR of the sampled costs.
+    """
+    num_kept = max(1, int(np.ceil(alpha * costs.size)))
+    return float(np.mean(np.partition(costs, num_kept - 1)[:num_kept]))
+
+
+def gibbs_objective(costs: np.ndarray, eta: float = 1.0) -> float:
+    """Gibbs objective (Li et al., 2020): -log of the sampled average of exp(-eta * cost).
+
+    Args:
+        costs (np.ndarray): Cost of each sampled basis state.
+        eta (float, optional): Inverse temperature. Defaults to 1.0.
+
+    Returns:
+        float: Gibbs objective of the sampled costs.
+    """
+    return float(np.log(costs.size) - logsumexp(-eta * costs))
+
+
+def top_k_objective(costs: np.ndarray, threshold: float) -> float:
+    """Opposite of the fraction of samples whose cost is at most the threshold (e.g. the cost of the k-th best basis state).
+
+    Args:
+        costs (np.ndarray): Cost of each sampled basis state.
+        threshold (float): Largest cost counted as a hit.
+
+    Returns:
+        float: Opposite of the fraction of hits, so that it is minimized.
+    """
+    return -float(np.count_nonzero(costs <= threshold)) / costs.size
+
+
+class QAOASampledCost:
+    """Sample-based cost function of a QAOA circuit (CVaR, Gibbs or top-k objective), to be minimized with scipy.optimize.minimize.
+    The measured QAOA circuit is transpiled only once, at instantiation, and the cost of every basis state is tabulated
+    once for Hamiltonians of at most COST_TABLE_MAX_QUBITS qubits. Each call then only binds the parameters, runs
+    the Sampler and looks up the costs of the samples.
+
+    Args:
+        hamiltonian (SparsePauliOp): Problem hamiltonian expressed as a sum of I and Z Pauli strings (cost function)
+        num_layers (int): Number of layers in the QAOA circuit.
+        backend (Backend): Backend used to instanciate the Sampler and transpile the circuit. Fake backends
+            (e.g. FakeNairobiV2) are simulated with their noise model (see noisy_simulator).
+        objective (str, optional): "cvar", "gibbs" or "top_k". Defaults to "cvar".
+        alpha (float, optional): Fraction of the samples kept by the CVaR objective. Defaults to 0.1.
+        eta (float, optional): Inverse temperature of the Gibbs objective. Defaults to 1.0.
+        top_k (int, optional): Number of best basis states counted as hits by the top-k objective. Defaults to 1.
+        shots (int, optional): Number of samples per evaluation. Defaults to 1024.
+        optimization_level (int, optional): Optimization level of the transpilation. Defaults to 1.
+        simulation_method (str, optional): Simulation method of fake backends. Defaults to None (see noisy_simulator).
+    """
+
+    def __init__(
+        self,
+        hamiltonian: SparsePauliOp,
+        num_layers: int,
+        backend: Backend,
+        objective: str = "cvar",
+        alpha: float = 0.1,
+        eta: float = 1.0,
+        top_k: int = 1,
+        shots: int = 1024,
+        optimization_level: int = 1,
+        simulation_method: str | None = None,
+    ):
+        if not is_diagonal(hamiltonian):
+            raise ValueError("The Hamiltonian contains X or Y Pauli operators and is not diagonal.")
+        self.hamiltonian = hamiltonian
+        self.num_layers = num_layers
+        self.shots = shots
+        self.sampler = Sampler(mode=noisy_simulator(backend, hamiltonian.num_qubits, simulation_method))
+
+        # Transpile the measured circuit once for all the optimization
+        self.isa_circuit, _ = transpile_qaoa(hamiltonian, num_layers, backend, optimization_level, measure=True)
+
+        # Cost of every basis state, looked up for each sample
+        self.cost_table = compute_diagonal(hamiltonian) if hamiltonian.num_qubits <= COST_TABLE_MAX_QUBITS else None
+
+        if objective == "cvar":
+            self.objective = lambda costs: cvar_objective(costs, alpha)
+        elif objective == "gibbs":
+            self.objective = lambda costs: gibbs_objective(costs, eta)
+        elif objective == "top_k":
+            if self.cost_table is None:
+                raise ValueError(f"The top-k objective needs the cost table, limited to {COST_TABLE_MAX_QUBITS} qubits.")
+            threshold = np.partition(self.cost_table, top_k - 1)[top_k - 1]
+            self.objective = lambda costs: top_k_objective(costs, threshold)
+        else:
+            raise ValueError(f"Unknown objective '{objective}', expected 'cvar', 'gibbs' or 'top_k'.")
+
+        # Number of calls to the Sampler
+        self.num_evals = 0
+
+    @property
+    def num_parameters(self) -> int:
+        """Number of parameters of the QAOA circuit."""
+        return self.isa_circuit.num_parameters
+
+    def sample_costs(self, params: np.ndarray) -> np.ndarray:
+        """Samples the QAOA circuit with the inputted parameters and returns the cost of each sample.
+
+        Args:
+            params (np.ndarray): Parameters to be inserted in the QAOA circuit.
+
+        Returns:
+            np.ndarray: Cost of the basis state measured at each shot.
+        """
+        self.num_evals += 1
+        count("sampler_calls")
+        with phase("sampling", shots=self.shots):
+            data = self.sampler.run([(self.isa_circuit, params, self.shots)]).result()[0].data.meas
+        samples = _bitarray_to_ints(data)
+        return self.cost_table[samples] if self.cost_table is not None else evaluate_costs(self.hamiltonian, samples)
+
+    def __call__(self, params: np.ndarray) -> float:
+        """Computes the sample-based objective for the QAOA circuit with the inputted parameters.
+
+        Args:
+            params (np.ndarray): Parameters to be inserted in the QAOA circuit.
+
+        Returns:
+            float: Objective associated to the input parameters.
+        """
+        return self.objective(self.sample_costs(params))
+
+
+def evaluate_landscape(
+    hamiltonian: SparsePauliOp, reps: int, param_grid: np.ndarray, backend: Backend | None = None
+) -> np.ndarray:
+    """Computes the cost landscape of a QAOA circuit over a grid of parameters, in a single Estimator job.
+    The parameters follow the order of QAOAAnsatz(hamiltonian, reps).parameters: the reps β first, then the reps γ.
+
+    Args:
+        hamiltonian (SparsePauliOp): Problem hamiltonian expressed as a sum of Pauli strings (cost function)
+        reps (int): Number of layers in the QAOA circuit.
+        param_grid (np.ndarray): Array of shape (..., 2 * reps) of parameters, β first then γ on the last axis.
+            For reps=1, a landscape over γ (rows) and β (columns) is np.stack([betas, gammas], axis=-1) with
+            gammas, betas = np.meshgrid(gamma_values, beta_values, indexing="ij").
+        backend (Backend, optional): Backend used to instanciate the Estimator. Defaults to None (AerSimulator).
+
+    Returns:
+        np.ndarray: Cost associated to each point of the grid, of shape param_grid.shape[:-1].
+    """
+    cost_function = QAOACostFunction(hamiltonian, reps, backend if backend is not None else AerSimulator())
+    return cost_function.evaluate_batch(param_grid)
+
+
+def interp_params(params: np.ndarray) -> np.ndarray:
+    """INTERP heuristic (Zhou et al., 2020): linear interpolation of the optimal parameters of p layers to p + 1 layers.
+
+    Args:
+        params (np.ndarray): Parameters of p layers (β first, then γ).
+
+    Returns:
+        np.ndarray: Initial parameters of p + 1 layers (β first, then γ).
+    """
+    num_layers = len(params) // 2
+    layers = np.arange(num_layers + 1)
+    # Each new angle i interpolates the angles i - 1 and i, the missing angles being 0
+    padded = np.zeros((2, num_layers + 2))
+    padded[:, 1:-1] = np.reshape(params, (2, num_layers))
+    new_params = (layers * padded[:, :-1] + (num_layers - layers) * padded[:, 1:]) / num_layers
+    return new_params.ravel()
+
+
+def _fourier_basis(num_layers: int) -> tuple[np.ndarray, np.ndarray]:
+    """Matrices mapping the FOURIER amplitudes (u, v) of p = num_layers layers to the angles γ = S u and β = C v."""
+    angles = np.outer(np.arange(num_layers) + 0.5, np.arange(num_layers) + 0.5) * np.pi / num_layers
+    return np.sin(angles), np.cos(angles)
+
+
+def fourier_params(params: np.ndarray) -> np.ndarray:
+    """FOURIER heuristic (Zhou et al., 2020): the optimal parameters of p layers are expanded on p sine (γ) and
+    cosine (β) modes, and the same amplitudes, with a new zero amplitude, are used for p + 1 layers.
+
+    Args:
+        params (np.ndarray): Parameters of p layers (β first, then γ).
+
+    Returns:
+        np.ndarray: Initial parameters of p + 1 layers (β first, then γ).
+    """
+    num_layers = len(params) // 2
+    betas, gammas = np.reshape(params, (2, num_layers))
+    sin_basis, cos_basis = _fourier_basis(num_layers)
+    u = np.append(np.linalg.solve(sin_basis, gammas), 0.0)
+    v = np.append(np.linalg.solve(cos_basis, betas), 0.0)
+
+    sin_basis, cos_basis = _fourier_basis(num_layers + 1)
+    return np.concatenate([cos_basis @ v, sin_basis @ u])
+
+
+# Heuristics used to initialize the parameters of p + 1 layers from the optimal parameters of p layers
+WARM_START_STRATEGIES = {"interp": interp_params, "fourier": fourier_params}
+
+
+def optimize_layer_by_layer(
+    hamiltonian: SparsePauliOp,
+    max_layers: int,
+    backend: Backend | None = None,
+    strategy: str = "interp",
+    initial_params: np.ndarray | None = None,
+    method: str = "COBYLA",
+    options: dict | None = None,
+) -> list[dict]:
+    """Optimizes QAOA circuits of 1 to max_layers layers, each depth starting from the optimum of the previous one.
+
+    Args:
+        hamiltonian (SparsePauliOp): Problem hamiltonian expressed as a sum of Pauli strings (cost function)
+        max_layers (int): Largest number of layers in the QAOA circuit.
+        backend (Backend, optional): Backend used to instanciate the Estimator. Defaults to None (AerSimulator).
+        strategy (str, optional): Warm start heuristic, "interp" or "fourier". Defaults to "interp".
+        initial_params (np.ndarray, optional): Initial parameters of the single-layer circuit. Defaults to None (zeros).
+        method (str, optional): Optimization method of scipy.optimize.minimize. Defaults to "COBYLA".
+        options (dict, optional): Options of scipy.optimize.minimize. Defaults to None.
+
+    Returns:
+        list[dict]: For each number of layers, the optimal parameters ("params") and cost ("cost"),
+            the number of cost evaluations ("num_evals") and the optimization time in seconds ("time").
+    """
+    if strategy not in WARM_START_STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}', expected one of {list(WARM_START_STRATEGIES)}.")
+    if backend is None:
+        backend = AerSimulator()
+
+    params = np.zeros(2) if initial_params is None else np.asarray(initial_params, dtype=float)
+    results = []
+    for num_layers in range(1, max_layers + 1):
+        if num_layers > 1:
+            params = WARM_START_STRATEGIES[strategy](params)
+
+        start = time.perf_counter()
+        # A single transpiled circuit per depth
+        cost_function = QAOACostFunction(hamiltonian, num_layers, backend)
+        with phase("optimization", num_layers=num_layers):
+            res_opt = minimize(cost_function, params, method=method, options=options)
+        params = res_opt.x
+
+        results.append(
+            {
+                "num_layers": num_layers,
+                "params": params,
+                "cost": float(res_opt.fun),
+                "num_evals": cost_function.num_evals,
+                "time": time.perf_counter() - start,
+            }
+        )
+        print(
+            f"Layers : {num_layers}, cost : {res_opt.fun:.4f}, "
+            f"evaluations : {cost_function.num_evals}, time : {results[-1]['time']:.2f} s"
+        )
+
+    return results
+
+
+# Cost function owned by each worker process of multistart_optimize (transpiled circuit and simulator)
+_WORKER_COST_FUNCTION: QAOACostFunction | None = None
+
+
+def _init_multistart_worker(hamiltonian: SparsePauliOp, reps: int, backend: Backend | None):
+    """Builds the cost function of a worker process once, before it runs its optimizations."""
+    global _WORKER_COST_FUNCTION
+    _WORKER_COST_FUNCTION = QAOACostFunction(hamiltonian, reps, backend if backend is not None else AerSimulator())
+
+
+def _run_single_start(task: tuple[np.ndarray, int, str, dict | None]) -> dict:
+    """Runs one optimization of multistart_optimize in a worker process, recording the cost of every evaluation."""
+    initial_params, seed, method, options = task
+    cost_function = _WORKER_COST_FUNCTION
+    # The seed of the simulator only depends on the start, not on the worker running it
+    cost_function.estimator.options.simulator.seed_simulator = seed
+
+    trajectory = []
+
+    def traced_cost_function(params: np.ndarray) -> float:
+        trajectory.append(cost_function(params))
+        return trajectory[-1]
+
+    res_opt = minimize(traced_cost_function, initial_params, method=method, options=options)
+    return {
+        "initial_params": initial_params,
+        "params": res_opt.x,
+        "cost": float(res_opt.fun),
+        "num_evals": len(trajectory),
+        "trajectory": np.array(trajectory),
+    }
+
+
+def multistart_optimize(
+    hamiltonian: SparsePauliOp,
+    reps: int,
+    n_starts: int,
+    workers: int | None = None,
+    sampling: str = "lhs",
+    seed: int | None = None,
+    backend: Backend | None = None,
+    method: str = "COBYLA",
+    options: dict | None = None,
+) -> tuple[dict, list[dict]]:
+    """Runs independent optimizations of a QAOA circuit from several initial points, across a process pool.
+    The worker processes are spawned, not forked: a child forked after the parent has run an Aer job can deadlock.
+    Each worker process transpiles the circuit and owns its simulator once, then runs its share of the optimizations.
+    The β are drawn in [0, π] and the γ in [0, 2π].
+
+    Args:
+        hamiltonian (SparsePauliOp): Problem hamiltonian expressed as a sum of Pauli strings (cost function)
+        reps (int): Number of layers in the QAOA circuit.
+        n_starts (int): Number of initial points.
+        workers (int, optional): Number of worker processes. Defaults to None (number of CPUs).
+        sampling (str, optional): "lhs" for a Latin hypercube of initial points, "random" for uniform ones. Defaults to "lhs".
+        seed (int, optional): Seed of the initial points and of the simulator seed of each start. Defaults to None.
+        backend (Backend, optional): Backend used to instanciate the Estimators. Defaults to None (AerSimulator).
+        method (str, optional): Optimization method of scipy.optimize.minimize. Defaults to "COBYLA".
+        options (dict, optional): Options of scipy.optimize.minimize. Defaults to None.
+
+    Returns:
+        tuple[dict, list[dict]]: Best optimization and all the optimizations, each with its initial parameters
+            ("initial_params"), optimal parameters ("params") and cost ("cost"), number of cost evaluations ("num_evals")
+            and the cost of every evaluation ("trajectory").
+    """
+    seed_sequence = np.random.SeedSequence(seed)
+    points_seed, simulator_seed = seed_sequence.spawn(2)
+
+    # Initial points in the unit hypercube, scaled to the ranges of β and γ
+    if sampling == "lhs":
+        unit_points = qmc.LatinHypercube(d=2 * reps, seed=np.random.default_rng(points_seed)).random(n_starts)
+    elif sampling == "random":
+        unit_points = np.random.default_rng(points_seed).random((n_starts, 2 * reps))
+    else:
+        raise ValueError(f"Unknown sampling '{sampling}', expected 'lhs' or 'random'.")
+    initial_points = unit_points * np.repeat([np.pi, 2 * np.pi], reps)
+
+    # One simulator seed per start, so the results do not depend on how the starts are shared between the workers
+    seeds = simulator_seed.generate_state(n_starts)
+    tasks = [(initial_points[i], int(seeds[i]), method, options) for i in range(n_starts)]
+    with phase("multistart_optimization", num_layers=reps, n_starts=n_starts):
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(workers, initializer=_init_multistart_worker, initargs=(hamiltonian, reps, backend)) as pool:
+            results = pool.map(_run_single_start, tasks)
+    count("estimator_calls", sum(result["num_evals"] for result in results))
+
+    best = min(results, key=lambda result: result["cost"])
+    return best, results
+
+
+def _adam(
+    fun_and_grad, x0: np.ndarray, maxiter: int = 200, learning_rate: float = 0.05, gtol: float = 1e-4
+) -> OptimizeResult:
+    """Adam gradient descent (Kingma and Ba, 2015), robust to the shot noise of the Estimator."""
+    if maxiter < 1:
+        raise ValueError(f"Adam needs at least one iteration, got maxiter={maxiter}.")
+    beta_1, beta_2, epsilon = 0.9, 0.999, 1e-8
+    x = np.asarray(x0, dtype=float).copy()
+    moment_1, moment_2 = np.zeros_like(x), np.zeros_like(x)
+    best_x, best_fun = x.copy(), np.inf
+
+    for iteration in range(1, maxiter + 1):
+        fun, grad = fun_and_grad(x)
+        if fun < best_fun:
+            best_x, best_fun = x.copy(), fun
+        if np.linalg.norm(grad) < gtol:
+            break
+        moment_1 = beta_1 * moment_1 + (1 - beta_1) * grad
+        moment_2 = beta_2 * moment_2 + (1 - beta_2) * grad**2
+        step = moment_1 / (1 - beta_1**iteration) / (np.sqrt(moment_2 / (1 - beta_2**iteration)) + epsilon)
+        x -= learning_rate * step
+
+    return OptimizeResult(x=best_x, fun=best_fun, nit=iteration, success=True)
+
+
+def optimize_with_gradient(
+    hamiltonian: SparsePauliOp,
+    num_layers: int,
+    backend: Backend | None = None,
+    initial_params: np.ndarray | None = None,
+    method: str = "L-BFGS-B",
+    options: dict | None = None,
+) -> OptimizeResult:
+    """Optimizes a QAOA circuit with a gradient-based method, the gradients being computed with the parameter-shift rule
+    in a single Estimator job per iteration (see QAOACostFunction.value_and_grad).
+
+    Args:
+        hamiltonian (SparsePauliOp): Problem hamiltonian expressed as a sum of Pauli strings (cost function)
+        num_layers (int): Number of layers in the QAOA circuit.
+        backend (Backend, optional): Backend used to instanciate the Estimator. Defaults to None (AerSimulator).
+        initial_params (np.ndarray, optional): Initial parameters. Defaults to None (0.1 for every parameter).
+        method (str, optional): "adam", or a gradient-based method of scipy.optimize.minimize. Defaults to "L-BFGS-B".
+        options (dict, optional): Options of scipy.optimize.minimize, or keyword arguments of the Adam loop
+            (maxiter, learning_rate, gtol). Defaults to None.
+
+    Returns:
+        OptimizeResult: Result of the optimization, with the optimal parameters (x) and cost (fun).
+    """
+    cost_function = QAOACostFunction(hamiltonian, num_layers, backend if backend is not None else AerSimulator())
+    # The gradient is zero at the origin, so the default initial point is moved away from it
+    params = np.full(cost_function.num_parameters, 0.1) if initial_params is None else np.asarray(initial_params)
+
+    with phase("optimization", num_layers=num_layers, method=method):
+        if method == "adam":
+            res_opt = _adam(cost_function.value_and_grad, params, **(options or {}))
+        else:
+            res_opt = minimize(cost_function.value_and_grad, params, jac=True, method=method, options=options)
+    res_opt.num_evals = cost_function.num_evals
+    return res_opt
+
+
+def _cost_details(costs: np.ndarray, weights: np.ndarray, min_cost: float, max_cost: float) -> dict:
+    """Approximation ratio and distribution of the costs of the measured basis states, weighted by their probabilities.
+    The ratio (max_cost - average cost) / (max_cost - min_cost) is 1 for the optimal solutions and 0 for the worst ones,
+    whatever the constant offset of the Hamiltonian, and 1 if every basis state has the same cost."""
+    cost_values, inverse = np.unique(costs, return_inverse=True)
+    cost_probabilities = np.bincount(inverse, weights=weights) / np.sum(weights)
+    cost_range = max_cost - min_cost
+    average_cost = cost_probabilities @ cost_values
+    return {
+        "approximation_ratio": float((max_cost - average_cost) / cost_range) if cost_range > 0 else 1.0,
+        "cost_values": cost_values,
+        "cost_probabilities": cost_probabilities,
+    }
 
 
 def calc_score(
-    params: np.ndarray, num_layers: int, hamiltonian: SparsePauliOp, backend: Backend
-) -> tuple[float, float]:
+    params: np.ndarray,
+    num_layers: int,
+    hamiltonian: SparsePauliOp,
+    backend: Backend | None = None,
+    mode: str = "sampling",
+    cache_dir: str | None = None,
+    return_details: bool = False,
+    shots: int | None = None,
+    simulation_method: str | None = None,
+) -> tuple[float, float] | tuple[float, float, dict]:
     """Computes the score associated to the inputted optimal parameters, for a quantum circuit containing the specified number of layers.
 
     Args:
         params (np.ndarray): Optimal parameters found during optimization.
         num_layers (int): Number of layers in the QAOA circuit.
         hamiltonian (SparsePauliOp): Problem hamiltonian expressed as a sum of Pauli strings (cost function)
-        backend (Backend): Backend used to instanciate an Estimator or Sampler.
+        backend (Backend, optional): Backend used to instanciate an Estimator or Sampler. Fake backends (e.g. FakeNairobiV2)
+            are simulated with their noise model (see noisy_simulator). Defaults to None (AerSimulator).
+        mode (str, optional): "sampling" to estimate the score with a Sampler and the cost with an Estimator on the backend,
+            or "exact" to compute both from the final statevector, without shot noise. Defaults to "sampling".
+        cache_dir (str, optional): Directory where the exact solutions are cached on disk. Defaults to None (memory only).
+        return_details (bool, optional): Also return the approximation ratio ((maximal cost - average measured cost) /
+            (maximal cost - minimal cost)) and the distribution of the measured costs, for diagonal Hamiltonians.
+            Defaults to False.
+        shots (int, optional): Number of shots of the Sampler and of the Estimator in sampling mode. Defaults to None
+            (defaults of the primitives).
+        simulation_method (str, optional): Simulation method of fake backends. Defaults to None (see noisy_simulator).
 
     Returns:
         tuple[float, float]: Optimal cost and score (%) of the found solution.
+            With return_details, a third element is a dict with the "approximation_ratio", the distinct measured
+            costs ("cost_values") and their probabilities ("cost_probabilities").
     """
-    # Building the QAOA circuit
-    circuit = QAOAAnsatz(hamiltonian, reps=num_layers)
-    # Compute the exact solutions for comparison purposes
-    _, binary_sol = compute_exact_sol(hamiltonian)
-
-    # Generate the probability distribution with the specified optimal parameters
-    sampler = Sampler(mode=backend)
-    circuit_copy = circuit.decompose(reps=2).copy()
-    circuit_copy.measure_all()
-    data = sampler.run([(circuit_copy, params)]).result()[0].data.meas
-    counts = data.get_counts()
-    nb_shots = data.num_shots
-
-    # Compute the score (ratio of the percentage of good solutions found to the number of shots used while running the algorithm)
-    score = 0
-    for sol in binary_sol:
-        if sol in counts:
-            score += counts[sol]
-    score /= nb_shots
-    score *= 100.0
-
-    # Compute the average value of the cost function obtained with the specified optimal parameters
-    estimator = Estimator(mode=backend)
-    pm = generate_preset_pass_manager(backend=estimator._backend, optimization_level=1)
-    isa_psi = pm.run(circuit)
-    isa_observables = hamiltonian.apply_layout(isa_psi.layout)
-    cost = estimator.run([(isa_psi, isa_observables, params)]).result()[0].data.evs
+    # Compute the exact solutions for comparison purposes (only once per Hamiltonian)
+    with phase("exact_solution"):
+        min_cost, binary_sol = compute_exact_sol_cached(hamiltonian, cache_dir=cache_dir)
+    sol_indices = [int(sol, 2) for sol in binary_sol]
+
+    if mode == "exact":
+        # Building the QAOA circuit (the sampling mode uses the transpiled circuits of transpile_qaoa instead)
+        with phase("ansatz", num_layers=num_layers):
+            circuit = QAOAAnsatz(hamiltonian, reps=num_layers)
+        # Compute the final state once, it gives both the probabilities of the good solutions and the average cost
+        with phase("binding"):
+            bound_circuit = circuit.assign_parameters(params)
+        count("statevector_simulations")
+        with phase("statevector"):
+            state = Statevector(bound_circuit)
+            probabilities = state.probabilities()
+
+        # Compute the score (probability of measuring one of the good solutions)
+        score = 100.0 * float(np.sum(probabilities[sol_indices]))
+        # Compute the average value of the cost function obtained with the specified optimal parameters
+        cost = float(state.expectation_value(hamiltonian).real)
+        if return_details:
+            diagonal = compute_diagonal(hamiltonian)
+            details = _cost_details(diagonal, probabilities, min_cost, float(diagonal.max()))
+        else:
+            details = None
+    elif mode == "sampling":
+        if backend is None:
+            backend = AerSimulator()
+
+        # Fake backends are simulated with their noise model, on the circuits transpiled for their target
+        simulator = noisy_simulator(backend, hamiltonian.num_qubits, simulation_method)
+
+        # Generate the samples with the specified optimal parameters
+        sampler = Sampler(mode=simulator)
+        isa_measured_circuit, _ = transpile_qaoa(hamiltonian, num_layers, backend, measure=True)
+        count("sampler_calls")
+        with phase("sampling"):
+            data = sampler.run([(isa_measured_circuit, params)], shots=shots).result()[0].data.meas
+        samples = _bitarray_to_ints(data)
+        nb_shots = data.num_shots
+
+        # Compute the score (ratio of the percentage of good solutions found to the number of shots used while running the algorithm)
+        score = 100.0 * np.count_nonzero(np.isin(samples, sol_indices)) / nb_shots
+
+        # Compute the average value of the cost function obtained with the specified optimal parameters
+        estimator = Estimator(mode=simulator)
+        if shots is not None:
+            estimator.options.default_shots = shots
+        isa_psi, isa_observables = transpile_qaoa(hamiltonian, num_layers, backend)
+        count("estimator_calls")
+        with phase("estimation"):
+            cost = estimator.run([(isa_psi, isa_observables, params)]).result()[0].data.evs
+        if return_details:
+            # The maximal cost is the minimal cost of -H, over all the basis states and not only the measured ones
+            max_cost = -compute_exact_sol_cached(-hamiltonian, cache_dir=cache_dir)[0]
+            details = _cost_details(evaluate_costs(hamiltonian, samples), np.ones(nb_shots), min_cost, max_cost)
+        else:
+            details = None
+    else:
+        raise ValueError(f"Unknown mode '{mode}', expected 'sampling' or 'exact'.")
 
     print("Optimal cost : ", cost)
     print("Score : ", score)
+    if details is not None:
+        print("Approximation ratio : ", details["approximation_ratio"])
+        return cost, score, details
     return cost, score
 
 
+def _pad(rows: list[list[float]]) -> np.ndarray:
+    """Stacks rows of different lengths in an array, padded with zeros (cos(0) = 1 is neutral in the products below)."""
+    padded = np.zeros((len(rows), max((len(row) for row in rows), default=0)))
+    for i, row in enumerate(rows):
+        padded[i, : len(row)] = row
+    return padded
+
+
+def _cos_prod(gamma: np.ndarray, couplings: np.ndarray) -> np.ndarray:
+    """Product over the last axis of cos(2γJ), for every parameter point (leading axes) and row of couplings."""
+    return np.prod(np.cos(2 * gamma[..., None, None] * couplings), axis=-1)
+
+
+class AnalyticP1Expectation:
+    """Closed-form average value of a Hamiltonian made of Z and ZZ terms, for a QAOA circuit with a single layer.
+    For p = 1, the average value of each term only depends on the neighborhoods of its qubits in the graph
+    of the ZZ couplings (Ozaeta, van Dam and McMahon, 2022), so no simulator is needed.
+
+    The Hamiltonian H = c + sum_u h_u Z_u + sum_(u,v) J_uv Z_u Z_v is analysed once, at instantiation.
+    The average values are then vectorized over any number of (γ, β) points.
+
+    Args:
+        hamiltonian (SparsePauliOp): Problem hamiltonian expressed as a sum of I, Z and ZZ Pauli strings (cost function)
+    """
+
+    def __init__(self, hamiltonian: SparsePauliOp):
+        if not is_diagonal(hamiltonian):
+            raise ValueError("The Hamiltonian contains X or Y Pauli operators and is not diagonal.")
+
+        # Sort the Pauli strings by constant, local field (Z) and coupling (ZZ) terms
+        self.constant = 0.0
+        fields = np.zeros(hamiltonian.num_qubits)
+        couplings: dict[tuple[int, int], float] = {}
+        for z, coeff in zip(hamiltonian.paulis.z, hamiltonian.coeffs.real):
+            support = tuple(np.flatnonzero(z))
+            if len(support) == 0:
+                self.constant += coeff
+            elif len(support) == 1:
+                fields[support[0]] += coeff
+            elif len(support) == 2:
+                couplings[support] = couplings.get(support, 0.0) + coeff
+            else:
+                raise ValueError("The analytic expectation only supports Pauli strings with at most two Z operators.")
+
+        # Couplings of each qubit to its neighbors
+        neighbors: list[dict[int, float]] = [{} for _ in range(hamiltonian.num_qubits)]
+        for (u, v), coupling in couplings.items():
+            neighbors[u][v] = coupling
+            neighbors[v][u] = coupling
+
+        # Z terms: local field of each qubit and couplings to all its neighbors
+        field_qubits = np.flatnonzero(fields)
+        self._fields = fields[field_qubits]
+        self._field_couplings = _pad([list(neighbors[u].values()) for u in field_qubits])
+
+        # ZZ terms: coupling of each edge, local fields of its ends, couplings of each end to the other neighbors,
+        # and couplings of both ends to every common or non-common neighbor
+        edges = list(couplings)
+        self._couplings = np.array([couplings[edge] for edge in edges])
+        self._fields_u = np.array([fields[u] for u, _ in edges])
+        self._fields_v = np.array([fields[v] for _, v in edges])
+        self._couplings_u = _pad([[J for w, J in neighbors[u].items() if w != v] for u, v in edges])
+        self._couplings_v = _pad([[J for w, J in neighbors[v].items() if w != u] for u, v in edges])
+        others = [sorted((neighbors[u].keys() | neighbors[v].keys()) - {u, v}) for u, v in edges]
+        self._shared_u = _pad([[neighbors[u].get(w, 0.0) for w in ws] for (u, v), ws in zip(edges, others)])
+        self._shared_v = _pad([[neighbors[v].get(w, 0.0) for w in ws] for (u, v), ws in zip(edges, others)])
+
+    def __call__(self, gamma: np.ndarray, beta: np.ndarray) -> np.ndarray:
+        """Computes the average value of the Hamiltonian for QAOA circuits with a single layer.
+
+        Args:
+            gamma (np.ndarray): Cost layer parameters γ.
+            beta (np.ndarray): Mixer layer parameters β, broadcastable with gamma.
+
+        Returns:
+            np.ndarray: Average value of the Hamiltonian at each (γ, β) point, of the broadcasted shape of gamma and beta.
+        """
+        gamma, beta = np.broadcast_arrays(gamma, beta)
+        g = gamma[..., None]
+        b = beta[..., None]
+
+        # <Z_u> = sin(2β) sin(2γh_u) prod_w cos(2γJ_uw)
+        z_terms = np.sin(2 * b) * np.sin(2 * g * self._fields) * _cos_prod(gamma, self._field_couplings)
+
+        # <Z_u Z_v> = sin(4β)/2 sin(2γJ_uv) [cos(2γh_u) prod_w cos(2γJ_uw) + cos(2γh_v) prod_w cos(2γJ_vw)]
+        #           - sin²(2β)/2 [cos(2γ(h_u + h_v)) prod_w cos(2γ(J_uw + J_vw)) - cos(2γ(h_u - h_v)) prod_w cos(2γ(J_uw - J_vw))]
+        zz_terms = np.sin(4 * b) / 2 * np.sin(2 * g * self._couplings) * (
+            np.cos(2 * g * self._fields_u) * _cos_prod(gamma, self._couplings_u)
+            + np.cos(2 * g * self._fields_v) * _cos_prod(gamma, self._couplings_v)
+        ) - np.sin(2 * b) ** 2 / 2 * (
+            np.cos(2 * g * (self._fields_u + self._fields_v)) * _cos_prod(gamma, self._shared_u + self._shared_v)
+            - np.cos(2 * g * (self._fields_u - self._fields_v)) * _cos_prod(gamma, self._shared_u - self._shared_v)
+        )
+
+        return self.constant + z_terms @ self._fields + zz_terms @ self._couplings
+
+    def value_and_grad(self, gamma: np.ndarray, beta: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Computes the average value of the Hamiltonian and its gradient for QAOA circuits with a single layer.
+        The derivatives are exact up to machine precision, obtained by complex-step differentiation of the closed form.
+
+        Args:
+            gamma (np.ndarray): Cost layer parameters γ.
+            beta (np.ndarray): Mixer layer parameters β, broadcastable with gamma.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray, np.ndarray]: Average value, derivative with respect to γ and derivative with respect to β.
+        """
+        step = 1e-30
+        gamma = np.asarray(gamma, dtype=float)
+        beta = np.asarray(beta, dtype=float)
+        value = self(gamma, beta)
+        grad_gamma = self(gamma + 1j * step, beta).imag / step
+        grad_beta = self(gamma, beta + 1j * step).imag / step
+
+        return value.real, grad_gamma, grad_beta
+
+
 def save_res(filename: str, params: np.ndarray, num_layers: int, hamiltonian: SparsePauliOp):
     """Saves your optimal parameters and optimal QAOA circuit. The saved file must be submitted to the mentors.
+    The file only contains plain numerical arrays (no pickled objects):
+        - format_version: version of the layout (RES_FORMAT_VERSION)
+        - params: optimal parameters (float64)
+        - num_layers: number of layers (int64)
+        - pauli_codes: (num_terms, num_qubits) uint8 matrix of the Pauli operators of each term, column j being
+          qubit j (0 = I, 1 = Z, 2 = X, 3 = Y)
+        - coeffs: coefficients of the terms (complex128)
 
     Args:
         filename (str): Name of the saved file. Use a significant name for your submission.
@@ -91,22 +1322,41 @@ def save_res(filename: str, params: np.ndarray, num_layers: int, hamiltonian: Sp
         num_layers (int): Number of layers in the QAOA circuit.
         hamiltonian (SparsePauliOp): Problem hamiltonian expressed as a sum of Pauli strings (cost function)
     """
-    np.savez(file=filename, params=params, num_layers=num_layers, hamiltonian=hamiltonian)
+    pauli_codes = hamiltonian.paulis.z.astype(np.uint8) + 2 * hamiltonian.paulis.x.astype(np.uint8)
+    np.savez(
+        file=filename,
+        format_version=RES_FORMAT_VERSION,
+        params=np.asarray(params, dtype=np.float64),
+        num_layers=np.int64(num_layers),
+        pauli_codes=pauli_codes,
+        coeffs=hamiltonian.coeffs.astype(np.complex128),
+    )
 
 
-def read_res(filename: str):
+def read_res(filename: str) -> tuple[np.ndarray, int, SparsePauliOp]:
     """Reads the information stored in the file generated by the function directly above
+    Pickled objects are never loaded, so files from participants can be opened safely.
 
     Args:
         filename (str):  Name of the file where you saved your optimal hyperparameters.
 
     Returns:
-        tuple[float, int, SparsePauliOp]: The optimal parameters, number of circuit layers and hamiltonian that were saved.
+        tuple[np.ndarray, int, SparsePauliOp]: The optimal parameters, number of circuit layers and hamiltonian that were saved.
     """
-    file = np.load(filename)
-    params = file["params"]
-    num_layers = file["num_layers"]
-    hamiltonian = file["hamiltonian"]
+    with np.load(filename, allow_pickle=False) as file:
+        params = file["params"]
+        num_layers = int(file["num_layers"])
+
+        if "format_version" not in file:
+            # Files saved before the versioned layout store the Hamiltonian as its dense matrix
+            hamiltonian = SparsePauliOp.from_operator(file["hamiltonian"])
+        elif int(file["format_version"]) == RES_FORMAT_VERSION:
+            # Rebuild every Pauli string at once from its symplectic (z, x) representation
+            pauli_codes = file["pauli_codes"]
+            paulis = PauliList.from_symplectic(pauli_codes & 1, pauli_codes >> 1)
+            hamiltonian = SparsePauliOp(paulis, file["coeffs"])
+        else:
+            raise ValueError(f"Unsupported file format version {int(file['format_version'])}.")
 
     return params, num_layers, hamiltonian
 
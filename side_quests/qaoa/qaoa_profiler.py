@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from qiskit import QuantumCircuit
+
+# Profiler recording the phases of problemes_utils, if any (see Profiler.__enter__)
+_ACTIVE_PROFILER = None
+
+
+class Profiler:
+    """Records the wall time of the phases of the QAOA utilities (ansatz construction, transpilation, execution, ...),
+    the depth and two-qubit gate count of the transpiled circuits and the number of simulator calls.
+
+    The functions of problemes_utils report to the profiler active in a with block:
+
+        with Profiler() as profiler:
+            calc_score(params, num_layers, hamiltonian, backend)
+        print(profiler.summary())
+        profiler.save_chrome_trace("trace.json")  # to open in chrome://tracing or https://ui.perfetto.dev
+    """
+
+    def __init__(self):
+        self.events: list[dict] = []
+        self.circuits: list[dict] = []
+        self.counters: Counter = Counter()
+        self._origin = time.perf_counter()
+        self._previous = None
+
+    def __enter__(self) -> "Profiler":
+        global _ACTIVE_PROFILER
+        self._previous, _ACTIVE_PROFILER = _ACTIVE_PROFILER, self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _ACTIVE_PROFILER
+        _ACTIVE_PROFILER = self._previous
+
+    @contextmanager
+    def phase(self, name: str, **args):
+        """Context manager recording the wall time of a phase.
+
+        Args:
+            name (str): Name of the phase.
+            **args: Information attached to the event (e.g. the number of layers).
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.events.append(
+                {
+                    "name": name,
+                    "start": start - self._origin,
+                    "duration": time.perf_counter() - start,
+                    "thread": threading.get_ident(),
+                    "args": args,
+                }
+            )
+
+    def count(self, name: str, value: int = 1):
+        """Increments a counter (e.g. the number of Estimator calls).
+
+        Args:
+            name (str): Name of the counter.
+            value (int, optional): Increment. Defaults to 1.
+        """
+        self.counters[name] += value
+
+    def record_circuit(self, name: str, circuit: QuantumCircuit):
+        """Records the size of a (transpiled) circuit.
+
+        Args:
+            name (str): Name of the circuit.
+            circuit (QuantumCircuit): Circuit to measure.
+        """
+        num_two_qubit_gates = sum(
+            1 for instruction in circuit.data if len(instruction.qubits) == 2 and instruction.operation.name != "barrier"
+        )
+        self.circuits.append(
+            {
+                "name": name,
+                "num_qubits": circuit.num_qubits,
+                "depth": circuit.depth(),
+                "num_two_qubit_gates": num_two_qubit_gates,
+                "count_ops": dict(circuit.count_ops()),
+            }
+        )
+
+    def summary(self) -> dict:
+        """Aggregates the recorded events.
+
+        Returns:
+            dict: Total time ("time") and number of occurrences ("calls") of each phase, counters and circuits.
+        """
+        phases: dict[str, dict] = {}
+        for event in self.events:
+            phase = phases.setdefault(event["name"], {"time": 0.0, "calls": 0})
+            phase["time"] += event["duration"]
+            phase["calls"] += 1
+        return {"phases": phases, "counters": dict(self.counters), "circuits": self.circuits}
+
+    def save_json(self, filename: str):
+        """Saves the summary and every recorded event as a JSON file.
+
+        Args:
+            filename (str): Name of the JSON file.
+        """
+        with open(filename, "w") as file:
+            json.dump({**self.summary(), "events": self.events}, file, indent=2, default=str)
+
+    def save_chrome_trace(self, filename: str):
+        """Saves the recorded events in the Chrome trace-event format.
+
+        Args:
+            filename (str): Name of the JSON file, to open in chrome://tracing or https://ui.perfetto.dev.
+        """
+        trace_events = [
+            {
+                "name": event["name"],
+                "ph": "X",
+                "ts": event["start"] * 1e6,
+                "dur": event["duration"] * 1e6,
+                "pid": os.getpid(),
+                "tid": event["thread"],
+                "args": event["args"],
+            }
+            for event in self.events
+        ]
+        with open(filename, "w") as file:
+            json.dump(
+                {"traceEvents": trace_events, "otherData": {"counters": dict(self.counters), "circuits": self.circuits}},
+                file,
+                default=str,
+            )
+
+
+@contextmanager
+def phase(name: str, **args):
+    """Records the wall time of a phase in the active profiler, if any (see Profiler.phase)."""
+    if _ACTIVE_PROFILER is None:
+        yield
+    else:
+        with _ACTIVE_PROFILER.phase(name, **args):
+            yield
+
+
+def count(name: str, value: int = 1):
+    """Increments a counter of the active profiler, if any (see Profiler.count)."""
+    if _ACTIVE_PROFILER is not None:
+        _ACTIVE_PROFILER.count(name, value)
+
+
+def record_circuit(name: str, circuit: QuantumCircuit):
+    """Records the size of a circuit in the active profiler, if any (see Profiler.record_circuit)."""
+    if _ACTIVE_PROFILER is not None:
+        _ACTIVE_PROFILER.record_circuit(name, circuit)
@@ -0,0 +1,143 @@
+import numpy as np
+
+from qiskit.quantum_info import SparsePauliOp
+
+from problemes_utils import compute_diagonal, has_z2_symmetry, reduce_z2_symmetry
+from qaoa_profiler import count, phase
+
+# Number of qubits whose RX rotations are applied together by the mixer, as a single 2^k x 2^k matrix product
+MIXER_BLOCK_QUBITS = 3
+
+
+class QAOASimulator:
+    """Statevector simulator dedicated to QAOA circuits of diagonal Hamiltonians, equivalent to QAOAAnsatz(hamiltonian, reps).
+    No circuit is built nor transpiled: the diagonal of the Hamiltonian is computed once, then
+        - each cost layer exp(-iγH) is an elementwise phase multiplication of the statevector,
+        - each mixer layer exp(-iβ sum_j X_j) is a product of RX(2β) rotations, applied MIXER_BLOCK_QUBITS qubits at a
+          time as a matrix product on one axis of the reshaped statevector.
+
+    If the Hamiltonian has the global bit-flip symmetry (e.g. MaxCut), the QAOA state has the same amplitude on each
+    basis state and its bit-flipped copy, so only the half of the statevector where the last qubit is 0 is simulated.
+
+    The parameters follow the order of QAOAAnsatz(hamiltonian, reps).parameters: the reps β first, then the reps γ.
+
+    Args:
+        hamiltonian (SparsePauliOp): Problem hamiltonian expressed as a sum of I and Z Pauli strings (cost function)
+        reps (int): Number of layers in the QAOA circuit.
+        use_symmetry (bool, optional): Simulate half of the statevector when the Hamiltonian has the global bit-flip
+            symmetry. Defaults to True.
+    """
+
+    def __init__(self, hamiltonian: SparsePauliOp, reps: int, use_symmetry: bool = True):
+        self.hamiltonian = hamiltonian
+        self.reps = reps
+        self.num_qubits = hamiltonian.num_qubits
+        self.symmetric = use_symmetry and self.num_qubits > 1 and has_z2_symmetry(hamiltonian)
+        # Cost of each simulated basis state, shared by every cost layer and by the average value
+        # (with the symmetry, the first half of the diagonal, where the last qubit is 0)
+        self.diagonal = compute_diagonal(reduce_z2_symmetry(hamiltonian) if self.symmetric else hamiltonian)
+        # (first qubit, number of qubits) of the blocks of qubits rotated together by the mixer
+        num_simulated_qubits = self.num_qubits - 1 if self.symmetric else self.num_qubits
+        self._mixer_blocks = [
+            (qubit, min(MIXER_BLOCK_QUBITS, num_simulated_qubits - qubit))
+            for qubit in range(0, num_simulated_qubits, MIXER_BLOCK_QUBITS)
+        ]
+        # Work array of the size of the simulated statevector, reused by every layer instead of temporary arrays
+        self._buffer = np.empty(self.diagonal.size, dtype=complex)
+
+        # Number of statevector simulations
+        self.num_evals = 0
+
+    @property
+    def num_parameters(self) -> int:
+        """Number of parameters of the QAOA circuit."""
+        return 2 * self.reps
+
+    def _apply_mixer(self, state: np.ndarray, beta: float):
+        """In-place RX(2β) = cos(β) I - i sin(β) X rotation of every qubit of the statevector."""
+        cos, sin = np.cos(beta), -1j * np.sin(beta)
+        rx = np.array([[cos, sin], [sin, cos]])
+        matrices = {1: rx}
+
+        # Each block is rotated out of place, alternately from the statevector to the buffer and back
+        source, target = state, self._buffer
+        for first_qubit, num_block_qubits in self._mixer_blocks:
+            while num_block_qubits not in matrices:
+                matrices[len(matrices) + 1] = np.kron(matrices[len(matrices)], rx)
+            # Axis 1 of the reshaped statevector holds the bits of the block (qubit 0 is the least significant bit)
+            shape = (-1, 2**num_block_qubits, 2**first_qubit)
+            np.matmul(matrices[num_block_qubits], source.reshape(shape), out=target.reshape(shape))
+            source, target = target, source
+        if source is not state:
+            np.copyto(state, source)
+
+        if self.symmetric:
+            # Flipping the last qubit of a simulated state gives the bit-flipped copy of the state where only the last
+            # qubit is unchanged, whose amplitude is stored at the reversed index
+            np.multiply(state[::-1], sin, out=self._buffer)
+            np.multiply(state, cos, out=state)
+            np.add(state, self._buffer, out=state)
+
+    def _evolve(self, params: np.ndarray) -> np.ndarray:
+        """Simulated part of the final statevector (the first half with the symmetry, else the full statevector)."""
+        params = np.asarray(params, dtype=float)
+        if params.size != self.num_parameters:
+            raise ValueError(f"Expected {self.num_parameters} parameters, got {params.size}.")
+        betas, gammas = params[: self.reps], params[self.reps :]
+
+        self.num_evals += 1
+        count("statevector_simulations")
+        with phase("statevector", num_layers=self.reps):
+            # Uniform superposition |+>^n
+            state = np.full(self.diagonal.size, 2 ** (-self.num_qubits / 2), dtype=complex)
+            for gamma, beta in zip(gammas, betas):
+                np.multiply(self.diagonal, -1j * gamma, out=self._buffer)
+                np.exp(self._buffer, out=self._buffer)
+                np.multiply(state, self._buffer, out=state)
+                self._apply_mixer(state, beta)
+
+        return state
+
+    def _expand(self, values: np.ndarray) -> np.ndarray:
+        """Values of all the 2^n basis states from the values of the simulated ones."""
+        return np.concatenate([values, values[::-1]]) if self.symmetric else values
+
+    def statevector(self, params: np.ndarray) -> np.ndarray:
+        """Computes the final statevector of the QAOA circuit with the inputted parameters.
+
+        Args:
+            params (np.ndarray): Parameters of the QAOA circuit (β first, then γ).
+
+        Returns:
+            np.ndarray: Amplitudes of the 2^n basis states, indexed as in Qiskit (qubit 0 is the least significant bit).
+        """
+        return self._expand(self._evolve(params))
+
+    def run(self, params: np.ndarray) -> tuple[float, np.ndarray]:
+        """Computes the average value of the Hamiltonian and the probability distribution of the QAOA circuit.
+
+        Args:
+            params (np.ndarray): Parameters of the QAOA circuit (β first, then γ).
+
+        Returns:
+            tuple[float, np.ndarray]:
+                - Average value of the Hamiltonian (float)
+                - Probability of each of the 2^n basis states
+        """
+        probabilities = np.abs(self._evolve(params)) ** 2
+        cost = probabilities @ self.diagonal
+        if self.symmetric:
+            # The other half of the statevector has the same probabilities and costs
+            cost *= 2
+        return float(cost), self._expand(probabilities)
+
+    def __call__(self, params: np.ndarray) -> float:
+        """Computes the average value of the Hamiltonian, to be used as a cost function with scipy.optimize.minimize.
+
+        Args:
+            params (np.ndarray): Parameters of the QAOA circuit (β first, then γ).
+
+        Returns:
+            float: Cost associated to the input parameters.
+        """
+        return self.run(params)[0]
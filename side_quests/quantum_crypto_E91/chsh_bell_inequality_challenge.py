@@ -1,6 +1,12 @@
+import hashlib
 import random
+import uuid
+import warnings
+from collections import OrderedDict
 import numpy as np
-from qiskit import QuantumCircuit
+from qiskit import ClassicalRegister, QuantumCircuit
+from qiskit.circuit import Clbit, IfElseOp, ParameterExpression, Qubit, SwitchCaseOp, WhileLoopOp
+from qiskit.circuit.exceptions import CircuitError
 from qiskit_aer import AerSimulator
 from qiskit import transpile
 import matplotlib.pyplot as plt
@@ -79,6 +85,10 @@ aer_simulator = AerSimulator()
 # to tie all run sequences to the main seed.
 MANUAL_SIMULATOR_SEED_COUNTER = GLOBAL_SEED
 
+# NumPy random generator of the analytic Born-rule sampler (see sample_bell_outcomes),
+# tied to the main seed as well.
+numpy_rng = np.random.default_rng(GLOBAL_SEED)
+
 # --- End of Global Seed and Simulator Initialization ---
 
 
@@ -86,11 +96,12 @@ MANUAL_SIMULATOR_SEED_COUNTER = GLOBAL_SEED
 # === HELPER FUNCTIONS ===
 # --------------------------------------------------------
 
-def run_circuit(circ: QuantumCircuit, shots=1) -> dict:
+def run_circuit(circ: QuantumCircuit, shots=1, transpiled=False) -> dict:
     """
     Run a quantum circuit on the AerSimulator and return the counts
     @param circ: QuantumCircuit to run
     @param shots: Number of shots to run the circuit
+    @param transpiled: True if the circuit is already transpiled for aer_simulator (e.g. compiled_measurement_circuit)
     @return: dictionary of measurement results and their counts
     """
 
@@ -104,12 +115,132 @@ def run_circuit(circ: QuantumCircuit, shots=1) -> dict:
     MANUAL_SIMULATOR_SEED_COUNTER += 1 # Increment for the next call to run_circuit
     # ---------------------------------
     
-    circ = transpile(circ, aer_simulator)
+    if not transpiled:
+        circ = transpile(circ, aer_simulator)
     result = aer_simulator.run(circ, shots=shots, seed_simulator=current_run_seed).result()
 
     return result.get_counts(circ) # get the counts of the circuit
 
 
+def run_circuits(circuits: list[QuantumCircuit], shots=1, transpiled=False) -> list[dict]:
+    """
+    Run a list of quantum circuits on the AerSimulator in a single job and return the counts of each circuit.
+    This is the batched version of run_circuit: the circuits are transpiled together and submitted
+    in one aer_simulator.run() call, instead of one transpilation and one job per circuit.
+    @param circuits: List of QuantumCircuits to run
+    @param shots: Number of shots to run each circuit
+    @param transpiled: True if the circuits are already transpiled for aer_simulator
+    @return: list of dictionaries of measurement results and their counts, in the order of the circuits
+    """
+
+    # ---------------------------------
+    # The job is seeded with the current value of the seed counter, and Aer derives the seed of each
+    # circuit from it and from the index of the circuit in the job (seed_simulator of each result).
+    # The counter then advances by one per circuit, as if run_circuit had been called on each of them,
+    # so the runs that follow are seeded the same way whichever path was used.
+    # Each circuit still gets its own reproducible seed, but not the one run_circuit would have given it:
+    # the distribution of the results is the same, not the individual outcomes.
+    global MANUAL_SIMULATOR_SEED_COUNTER # Global variable to keep track of the seed counter
+    global aer_simulator                 # Global aer_simulator instance
+
+    if len(circuits) == 0:
+        return []
+
+    current_run_seed = MANUAL_SIMULATOR_SEED_COUNTER
+    MANUAL_SIMULATOR_SEED_COUNTER += len(circuits) # Advance by one seed per circuit
+    # ---------------------------------
+
+    if not transpiled:
+        circuits = transpile(circuits, aer_simulator)
+    result = aer_simulator.run(circuits, shots=shots, seed_simulator=current_run_seed).result()
+
+    return [result.get_counts(i) for i in range(len(circuits))] # get the counts of each circuit
+
+
+def _bit_key(circ: QuantumCircuit, bits) -> str:
+    """Indices in the circuit of a bit, a register or a list of bits, as a string."""
+    if isinstance(bits, (Clbit, Qubit)):
+        return str(circ.find_bit(bits).index)
+    return str([circ.find_bit(bit).index for bit in bits])
+
+
+def _condition_key(circ: QuantumCircuit, operation) -> str:
+    """
+    Description of the classical condition of an operation: the condition of an if_test / while_loop, the target and
+    case values of a switch, or the condition set by c_if on any other instruction
+    @param circ: QuantumCircuit containing the operation
+    @param operation: Operation of an instruction of the circuit
+    @return: string made of the indices of the condition bits and of the compared value, empty without condition
+    @raise TypeError: if the condition cannot be described reliably (e.g. a classical expression)
+    """
+    if isinstance(operation, SwitchCaseOp):
+        target = operation.target
+        if not isinstance(target, (Clbit, ClassicalRegister)):
+            raise TypeError(f"Cannot describe the target of '{operation.name}'.")
+        return f"{_bit_key(circ, target)}in{[values for values, _ in operation.cases_specifier()]}"
+
+    if isinstance(operation, (IfElseOp, WhileLoopOp)):
+        condition = operation.condition
+    elif not getattr(operation, "mutable", True):
+        # Shared immutable instances of standard gates (x, h, cx, measure, ...) cannot carry a condition
+        condition = None
+    else:
+        # Instruction.condition (set by c_if) is deprecated since Qiskit 1.3 and has no replacement to read it
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            condition = getattr(operation, "condition", None)
+
+    if condition is None:
+        return ""
+    if isinstance(condition, tuple) and len(condition) == 2:
+        return f"{_bit_key(circ, condition[0])}=={int(condition[1])}"
+    raise TypeError(f"Cannot describe the condition of '{operation.name}'.")
+
+
+def _circuit_key(circ: QuantumCircuit) -> str:
+    """
+    Description of the content of a circuit, recursing into the blocks of control-flow operations
+    @param circ: QuantumCircuit to describe
+    @return: string made of the name, parameters, condition and bits of each instruction
+    @raise TypeError: if an instruction has a parameter or condition that cannot be described reliably
+    """
+    parts = [f"{circ.num_qubits},{circ.num_clbits}"]
+    for instruction in circ.data:
+        operation = instruction.operation
+        params = []
+        for param in operation.params:
+            if isinstance(param, QuantumCircuit):
+                # Block of a control-flow operation (if_test, while_loop, ...)
+                params.append(f"[{_circuit_key(param)}]")
+            elif isinstance(param, np.ndarray):
+                params.append(hashlib.sha256(np.ascontiguousarray(param).tobytes()).hexdigest())
+            elif isinstance(param, (int, float, complex, str, np.number, ParameterExpression)) or param is None:
+                params.append(repr(param))
+            else:
+                raise TypeError(f"Cannot describe the parameter {type(param).__name__} of '{operation.name}'.")
+
+        condition_key = _condition_key(circ, operation)
+        qubits = _bit_key(circ, instruction.qubits)
+        clbits = _bit_key(circ, instruction.clbits)
+        parts.append(f"{operation.name}{params}if({condition_key}){qubits}{clbits}")
+    return ";".join(parts)
+
+
+def circuit_fingerprint(circ: QuantumCircuit) -> str:
+    """
+    Content hash of a circuit, equal for circuits made of the same instructions, with the same parameters,
+    classical conditions and control-flow blocks, on the same qubits and bits (e.g. two separately created singlet
+    state circuits). A circuit containing an instruction that cannot be described reliably gets a unique fingerprint,
+    so it is never mistaken for another one.
+    @param circ: QuantumCircuit to identify
+    @return: SHA-256 hex digest of the content of the circuit, or a unique 'unique-...' string
+    """
+    try:
+        return hashlib.sha256(_circuit_key(circ).encode()).hexdigest()
+    except (TypeError, CircuitError):
+        return f"unique-{uuid.uuid4().hex}"
+
+
 # --------------------------------------------------------
 # === BELL STATE GENERATION ===
 # --------------------------------------------------------
@@ -347,6 +478,517 @@ def check_bell_inequality(chsh_value: float) -> bool:
     
 
 
+# --------------------------------------------------------
+# === AGGREGATED BELL TEST ===
+# Every Bell pair of a test is prepared by one of a few identical circuits, and measured in one of the four
+# (alice_basis, bob_basis) combinations. Instead of running one 1-shot circuit per pair, the pairs are grouped by
+# prepared state and basis combination, and each group is run once with as many shots as it has pairs.
+# --------------------------------------------------------
+
+def basis_measurement_circuit(circuit: QuantumCircuit, alice_basis: str, bob_basis: str) -> QuantumCircuit:
+    """
+    Copy of a two-qubit state circuit, measured in Alice's basis on qubit 0 and in Bob's basis on qubit 1.
+
+    As in apply_basis_transformation, measuring in the basis at angle θ from the Z-axis towards the X-axis
+    is done by applying Ry(-θ) before a Z measurement.
+
+    Args:
+        circuit: Circuit preparing the two-qubit state (it may contain its own measurements, e.g. Eve's).
+        alice_basis: Alice's measurement basis, as an angle in degrees ('0', '45', '90', '135').
+        bob_basis: Bob's measurement basis, as an angle in degrees ('0', '45', '90', '135').
+
+    Returns:
+        QuantumCircuit: The measured circuit, whose results are stored in the classical register 'bell'.
+    """
+    measured = circuit.copy()
+    bell_register = ClassicalRegister(2, 'bell')
+    measured.add_register(bell_register)
+    measured.ry(-np.radians(float(alice_basis)), 0)
+    measured.ry(-np.radians(float(bob_basis)), 1)
+    measured.measure([0, 1], bell_register)
+    return measured
+
+
+# Cache of the measurement circuits transpiled for aer_simulator, from (state fingerprint, alice_basis, bob_basis)
+# to the circuit, least recently used first. There are only a few prepared states and basis combinations in a
+# Bell test or an E91 run, but a test on random states would otherwise keep one entry per pair.
+_MEASUREMENT_CIRCUIT_CACHE: OrderedDict[tuple[str, str, str], QuantumCircuit] = OrderedDict()
+# Number of transpiled measurement circuits kept in the cache
+MEASUREMENT_CIRCUIT_CACHE_SIZE = 64
+
+
+def compiled_measurement_circuit(
+    circuit: QuantumCircuit,
+    alice_basis: str,
+    bob_basis: str,
+    fingerprint: str = None
+) -> QuantumCircuit:
+    """
+    Measured and transpiled version of a state circuit (see basis_measurement_circuit), built once per
+    (state, alice_basis, bob_basis) and then reused, so that measuring a pair neither copies nor transpiles a circuit.
+    The cache keeps the MEASUREMENT_CIRCUIT_CACHE_SIZE most recently used circuits; circuits with a unique
+    fingerprint (see circuit_fingerprint) are transpiled but never cached.
+
+    Args:
+        circuit: Circuit preparing the two-qubit state.
+        alice_basis: Alice's measurement basis ('0', '45', '90', '135').
+        bob_basis: Bob's measurement basis ('0', '45', '90', '135').
+        fingerprint: circuit_fingerprint of the circuit, if already known.
+
+    Returns:
+        QuantumCircuit: The measured circuit transpiled for aer_simulator, shared with the cache (do not modify it).
+    """
+    if fingerprint is None:
+        fingerprint = circuit_fingerprint(circuit)
+    key = (fingerprint, alice_basis, bob_basis)
+    if key in _MEASUREMENT_CIRCUIT_CACHE:
+        _MEASUREMENT_CIRCUIT_CACHE.move_to_end(key)
+        return _MEASUREMENT_CIRCUIT_CACHE[key]
+
+    measured = transpile(basis_measurement_circuit(circuit, alice_basis, bob_basis), aer_simulator)
+    if not fingerprint.startswith("unique-"):
+        _MEASUREMENT_CIRCUIT_CACHE[key] = measured
+        if len(_MEASUREMENT_CIRCUIT_CACHE) > MEASUREMENT_CIRCUIT_CACHE_SIZE:
+            _MEASUREMENT_CIRCUIT_CACHE.popitem(last=False)
+    return measured
+
+
+def measure_bell_pair_cached(
+    circuit: QuantumCircuit,
+    alice_basis: str,
+    bob_basis: str
+) -> str:
+    """
+    Version of measure_bell_pair running the cached measurement circuit of the pair (see compiled_measurement_circuit).
+
+    Args:
+        circuit: Bell pair circuit to measure.
+        alice_basis: Alice's measurement basis ('0', '45', '90', '135').
+        bob_basis: Bob's measurement basis ('0', '45', '90', '135').
+
+    Returns:
+        str: The measurement result string ('00', '01', etc.), Alice's bit first.
+    """
+    counts = run_circuit(compiled_measurement_circuit(circuit, alice_basis, bob_basis), shots=1, transpiled=True)
+    # The 'bell' register is printed first; Qiskit writes qubit 0 rightmost, Alice's bit goes first
+    return next(iter(counts)).split()[0][::-1]
+
+
+def run_bell_test_measurements_aggregated(
+    list_bell_pairs,
+    list_alice_bases=ALICE_BELL_BASES,
+    list_bob_bases=BOB_BELL_BASES
+):
+    """
+    Aggregated version of run_bell_test_measurements, with the same statistics but far fewer simulations.
+
+    For each Bell pair, Alice's and Bob's measurement bases are randomly chosen. The pairs are then grouped by
+    prepared state (circuit_fingerprint) and basis combination, and each group is measured by a single circuit
+    run with shots = number of pairs in the group.
+    The outcomes of each group are shuffled with the seeded random generator and handed back to its pairs.
+    A 1000-pair singlet test thus runs 4 circuits instead of 1000.
+
+    Args:
+        list_bell_pairs: List of quantum circuits containing Bell pairs.
+        list_alice_bases: List of possible measurement bases for Alice.
+        list_bob_bases: List of possible measurement bases for Bob.
+
+    Returns:
+        Tuple of three lists:
+            - list_measurements_results: List of measurement results as bitstrings, Alice's bit (qubit 0) first.
+            - list_chosen_bases_alice: List of Alice's bases used for each measurement.
+            - list_chosen_bases_bob: List of Bob's bases used for each measurement.
+    """
+    list_chosen_bases_alice = [random.choice(list_alice_bases) for _ in list_bell_pairs]
+    list_chosen_bases_bob = [random.choice(list_bob_bases) for _ in list_bell_pairs]
+
+    # Indices of the pairs of each (prepared state, alice_basis, bob_basis) group
+    groups: dict[tuple[str, str, str], list[int]] = {}
+    circuits: dict[str, QuantumCircuit] = {}
+    for index, (circuit, alice_basis, bob_basis) in enumerate(
+            zip(list_bell_pairs, list_chosen_bases_alice, list_chosen_bases_bob)):
+        fingerprint = circuit_fingerprint(circuit)
+        circuits.setdefault(fingerprint, circuit)
+        groups.setdefault((fingerprint, alice_basis, bob_basis), []).append(index)
+
+    # One measured circuit per group, with one shot per pair, and its outcomes shuffled back to its pairs
+    list_measurements_results = [None] * len(list_bell_pairs)
+    for (fingerprint, alice_basis, bob_basis), indices in groups.items():
+        measured = compiled_measurement_circuit(circuits[fingerprint], alice_basis, bob_basis, fingerprint=fingerprint)
+        counts = run_circuit(measured, shots=len(indices), transpiled=True)
+
+        outcomes = []
+        for bitstring, count in counts.items():
+            # The 'bell' register is printed first; Qiskit writes qubit 0 rightmost, Alice's bit goes first
+            outcomes.extend([bitstring.split()[0][::-1]] * count)
+        random.shuffle(outcomes)
+        for index, outcome in zip(indices, outcomes):
+            list_measurements_results[index] = outcome
+
+    return list_measurements_results, list_chosen_bases_alice, list_chosen_bases_bob
+
+
+# --------------------------------------------------------
+# === ANALYTIC BELL SAMPLER ===
+# The states of the Bell tests have closed-form outcome probabilities when both qubits are measured
+# in bases at angles a (Alice) and b (Bob) in the X-Z plane (Ry(-angle) then Z measurement):
+#   - singlet |Ψ-⟩: each outcome of Alice is equally likely, and
+#       P(same outcomes) = sin²((a - b) / 2),  P(different outcomes) = cos²((a - b) / 2),  E(a, b) = -cos(a - b)
+#   - product state Ry(φA)|0⟩ ⊗ Ry(φB)|0⟩: independent outcomes, P(Alice gets 0) = cos²((φA - a) / 2)
+#   - eavesdropped singlet: Eve's Z measurement leaves |01⟩ or |10⟩ (φA, φB = 0, π or π, 0) with equal probability
+# Sampling them with NumPy needs no circuit nor simulator, which allows tests with millions of pairs.
+# --------------------------------------------------------
+
+# States handled by the analytic sampler
+ANALYTIC_STATES = ['singlet', 'product', 'eavesdropped']
+
+
+def sample_bell_outcomes(
+    alice_angles: np.ndarray,
+    bob_angles: np.ndarray,
+    state: str = 'singlet',
+    rng: np.random.Generator = None,
+    product_angles: tuple[np.ndarray, np.ndarray] = None,
+    eve_fraction: float = EVE_PERCENTAGE_COMPROMISED
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Draw the measurement outcomes of many pairs at once from the Born rule, without any simulation.
+
+    All the random numbers are drawn by a single rng.random call, and the outcomes are computed with array operations.
+
+    Args:
+        alice_angles: Alice's measurement angle of each pair, in degrees.
+        bob_angles: Bob's measurement angle of each pair, in degrees.
+        state: State of the pairs, one of ANALYTIC_STATES:
+            'singlet'      - Bell singlet state |Ψ-⟩ = (|01⟩ - |10⟩)/√2
+            'product'      - product state Ry(φA)|0⟩ ⊗ Ry(φB)|0⟩ (classical state)
+            'eavesdropped' - singlet state, measured in the Z basis by Eve with probability eve_fraction
+        rng: NumPy random generator. Defaults to the module generator numpy_rng (seeded with GLOBAL_SEED).
+        product_angles: Preparation angles (φA, φB) in degrees of each pair for the 'product' state.
+                        Defaults to uniformly random angles.
+        eve_fraction: Probability that Eve intercepts each pair of the 'eavesdropped' state.
+
+    Returns:
+        Tuple of two uint8 arrays: Alice's and Bob's outcome (0 or 1) of each pair.
+    """
+    if rng is None:
+        rng = numpy_rng
+    alice_angles = np.radians(np.asarray(alice_angles, dtype=float))
+    bob_angles = np.radians(np.asarray(bob_angles, dtype=float))
+    num_pairs = alice_angles.size
+
+    if state == 'singlet':
+        random_numbers = rng.random((2, num_pairs))
+        alice_bits = random_numbers[0] < 0.5
+        # Bob's outcome differs from Alice's with probability cos²((a - b) / 2)
+        different = random_numbers[1] < np.cos((alice_angles - bob_angles) / 2) ** 2
+        bob_bits = alice_bits ^ different
+    elif state == 'product':
+        if product_angles is None:
+            random_numbers = rng.random((4, num_pairs))
+            alice_state_angles, bob_state_angles = 2 * np.pi * random_numbers[2:]
+        else:
+            random_numbers = rng.random((2, num_pairs))
+            alice_state_angles, bob_state_angles = (np.radians(np.asarray(angles, dtype=float))
+                                                    for angles in product_angles)
+        alice_bits = random_numbers[0] >= np.cos((alice_state_angles - alice_angles) / 2) ** 2
+        bob_bits = random_numbers[1] >= np.cos((bob_state_angles - bob_angles) / 2) ** 2
+    elif state == 'eavesdropped':
+        random_numbers = rng.random((4, num_pairs))
+        intercepted = random_numbers[0] < eve_fraction
+        # Untouched pairs: singlet statistics
+        singlet_alice = random_numbers[1] < 0.5
+        singlet_bob = singlet_alice ^ (random_numbers[2] < np.cos((alice_angles - bob_angles) / 2) ** 2)
+        # Intercepted pairs: Eve finds Alice's qubit in |e⟩ and Bob's in |1 - e⟩, with e = random_numbers[1] < 0.5,
+        # and both are then measured independently (P(0) = cos²(angle / 2) for |0⟩ and sin²(angle / 2) for |1⟩)
+        eve_alice_bits = singlet_alice
+        alice_prob_0 = np.where(eve_alice_bits, np.sin(alice_angles / 2) ** 2, np.cos(alice_angles / 2) ** 2)
+        bob_prob_0 = np.where(eve_alice_bits, np.cos(bob_angles / 2) ** 2, np.sin(bob_angles / 2) ** 2)
+        eve_alice = random_numbers[2] >= alice_prob_0
+        eve_bob = random_numbers[3] >= bob_prob_0
+        alice_bits = np.where(intercepted, eve_alice, singlet_alice)
+        bob_bits = np.where(intercepted, eve_bob, singlet_bob)
+    else:
+        raise ValueError(f"Unknown state '{state}', expected one of {ANALYTIC_STATES}.")
+
+    return alice_bits.astype(np.uint8), bob_bits.astype(np.uint8)
+
+
+def measure_bell_pair_analytic(
+    alice_basis: str,
+    bob_basis: str,
+    state: str = 'singlet',
+    rng: np.random.Generator = None
+) -> str:
+    """
+    Analytic version of measure_bell_pair: measure a single pair of a known state (see sample_bell_outcomes).
+
+    Args:
+        alice_basis: Alice's measurement basis ('0', '45', '90', '135').
+        bob_basis: Bob's measurement basis ('0', '45', '90', '135').
+        state: State of the pair, one of ANALYTIC_STATES.
+        rng: NumPy random generator. Defaults to numpy_rng.
+
+    Returns:
+        str: The measurement result string ('00', '01', etc.), Alice's bit first.
+    """
+    alice_bits, bob_bits = sample_bell_outcomes([float(alice_basis)], [float(bob_basis)], state=state, rng=rng)
+    return f"{alice_bits[0]}{bob_bits[0]}"
+
+
+def run_bell_test_measurements_analytic(
+    num_pairs: int,
+    state: str = 'singlet',
+    list_alice_bases=ALICE_BELL_BASES,
+    list_bob_bases=BOB_BELL_BASES,
+    rng: np.random.Generator = None,
+    as_records: bool = False,
+    **kwargs
+):
+    """
+    Analytic version of run_bell_test_measurements, for num_pairs pairs of a known state.
+
+    The bases of all the pairs are chosen at random and their outcomes drawn at once (see sample_bell_outcomes).
+    For millions of pairs, as_records avoids building the lists of strings.
+
+    Args:
+        num_pairs: Number of Bell pairs.
+        state: State of the pairs, one of ANALYTIC_STATES.
+        list_alice_bases: List of possible measurement bases for Alice.
+        list_bob_bases: List of possible measurement bases for Bob.
+        rng: NumPy random generator. Defaults to numpy_rng.
+        as_records: If True, return the measurements as BellMeasurementRecords instead of three lists.
+        **kwargs: product_angles or eve_fraction, passed to sample_bell_outcomes.
+
+    Returns:
+        Tuple of three lists, as run_bell_test_measurements:
+            - list_measurements_results: List of measurement results as bitstrings, Alice's bit first.
+            - list_chosen_bases_alice: List of Alice's bases used for each measurement.
+            - list_chosen_bases_bob: List of Bob's bases used for each measurement.
+        or BellMeasurementRecords with as_records.
+    """
+    if rng is None:
+        rng = numpy_rng
+    alice_basis_indices = rng.integers(len(list_alice_bases), size=num_pairs, dtype=np.uint8)
+    bob_basis_indices = rng.integers(len(list_bob_bases), size=num_pairs, dtype=np.uint8)
+    alice_angles = np.array(list_alice_bases, dtype=float)[alice_basis_indices]
+    bob_angles = np.array(list_bob_bases, dtype=float)[bob_basis_indices]
+
+    alice_bits, bob_bits = sample_bell_outcomes(alice_angles, bob_angles, state=state, rng=rng, **kwargs)
+    records = BellMeasurementRecords(
+        alice_basis_indices, bob_basis_indices, alice_bits, bob_bits, list_alice_bases, list_bob_bases)
+
+    return records if as_records else records.to_lists()
+
+
+# --------------------------------------------------------
+# === MEASUREMENT RECORDS ===
+# Compact storage of the measurements of many pairs: the bases are stored as uint8 indices in the lists of
+# possible bases, and the outcomes are packed 4 pairs per byte (2 bits per pair: Alice's bit, then Bob's bit).
+# Sifting, grouping by basis pair and correlations are then array operations instead of loops over strings.
+# --------------------------------------------------------
+
+class BellMeasurementRecords:
+    """
+    Measurement records of a Bell test or an E91 run, equivalent to the three parallel lists
+    (results, Alice's bases, Bob's bases) returned by run_bell_test_measurements.
+
+    Args:
+        alice_basis_indices: Index in alice_bases of Alice's basis of each pair (uint8 array).
+        bob_basis_indices: Index in bob_bases of Bob's basis of each pair (uint8 array).
+        alice_bits: Alice's outcome (0 or 1) of each pair.
+        bob_bits: Bob's outcome (0 or 1) of each pair.
+        alice_bases: List of possible measurement bases for Alice.
+        bob_bases: List of possible measurement bases for Bob.
+    """
+
+    def __init__(
+        self,
+        alice_basis_indices: np.ndarray,
+        bob_basis_indices: np.ndarray,
+        alice_bits: np.ndarray,
+        bob_bits: np.ndarray,
+        alice_bases=ALICE_BELL_BASES,
+        bob_bases=BOB_BELL_BASES
+    ):
+        self.alice_bases = list(alice_bases)
+        self.bob_bases = list(bob_bases)
+        self.alice_basis_indices = np.asarray(alice_basis_indices, dtype=np.uint8)
+        self.bob_basis_indices = np.asarray(bob_basis_indices, dtype=np.uint8)
+        self.num_pairs = self.alice_basis_indices.size
+
+        # Outcome code of each pair: 2 * Alice's bit + Bob's bit, i.e. the result string '00', '01', '10', '11' in binary
+        codes = (np.asarray(alice_bits, dtype=np.uint8) << 1) | np.asarray(bob_bits, dtype=np.uint8)
+        # Pack 4 codes per byte, the first pair in the 2 least significant bits
+        codes = np.pad(codes, (0, -self.num_pairs % 4)).reshape(-1, 4)
+        self.packed_outcomes = np.bitwise_or.reduce(codes << np.array([0, 2, 4, 6], dtype=np.uint8), axis=1)
+
+    @classmethod
+    def from_lists(
+        cls,
+        list_measurements_results: list[str],
+        list_chosen_bases_alice: list[str],
+        list_chosen_bases_bob: list[str],
+        alice_bases=ALICE_BELL_BASES,
+        bob_bases=BOB_BELL_BASES
+    ) -> "BellMeasurementRecords":
+        """
+        Build the records from the three lists returned by run_bell_test_measurements.
+
+        Args:
+            list_measurements_results: List of measurement results as bitstrings, Alice's bit first.
+            list_chosen_bases_alice: List of Alice's bases used for each measurement.
+            list_chosen_bases_bob: List of Bob's bases used for each measurement.
+            alice_bases: List of possible measurement bases for Alice.
+            bob_bases: List of possible measurement bases for Bob.
+
+        Returns:
+            BellMeasurementRecords: The records of the measurements.
+        """
+        codes = np.array([int(result, 2) for result in list_measurements_results], dtype=np.uint8)
+        alice_index = {basis: i for i, basis in enumerate(alice_bases)}
+        bob_index = {basis: i for i, basis in enumerate(bob_bases)}
+        return cls(
+            [alice_index[basis] for basis in list_chosen_bases_alice],
+            [bob_index[basis] for basis in list_chosen_bases_bob],
+            codes >> 1,
+            codes & 1,
+            alice_bases,
+            bob_bases
+        )
+
+    def __len__(self) -> int:
+        return self.num_pairs
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the arrays of the records, in bytes."""
+        return self.alice_basis_indices.nbytes + self.bob_basis_indices.nbytes + self.packed_outcomes.nbytes
+
+    @property
+    def outcomes(self) -> np.ndarray:
+        """Outcome code (2 * Alice's bit + Bob's bit) of each pair."""
+        codes = (self.packed_outcomes[:, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3
+        return codes.ravel()[:self.num_pairs]
+
+    @property
+    def alice_bits(self) -> np.ndarray:
+        """Alice's outcome of each pair."""
+        return self.outcomes >> 1
+
+    @property
+    def bob_bits(self) -> np.ndarray:
+        """Bob's outcome of each pair."""
+        return self.outcomes & 1
+
+    def to_lists(self) -> tuple[list[str], list[str], list[str]]:
+        """
+        Convert the records back to the three lists returned by run_bell_test_measurements.
+
+        Returns:
+            Tuple of three lists: the measurement results ('00', '01', ...), Alice's bases and Bob's bases.
+        """
+        results = np.array(['00', '01', '10', '11'])[self.outcomes]
+        return (results.tolist(),
+                np.asarray(self.alice_bases)[self.alice_basis_indices].tolist(),
+                np.asarray(self.bob_bases)[self.bob_basis_indices].tolist())
+
+    def basis_pair_mask(self, basis_pairs: list[tuple[str, str]]) -> np.ndarray:
+        """
+        Boolean mask of the pairs measured in one of the given (alice_basis, bob_basis) combinations.
+
+        Args:
+            basis_pairs: List of (alice_basis, bob_basis) combinations, e.g. [('45', '45'), ('90', '90')].
+
+        Returns:
+            np.ndarray: True for each pair measured in one of the combinations.
+        """
+        # Table of the selected combinations, indexed by (Alice's basis index, Bob's basis index)
+        selected = np.zeros((len(self.alice_bases), len(self.bob_bases)), dtype=bool)
+        for alice_basis, bob_basis in basis_pairs:
+            if alice_basis in self.alice_bases and bob_basis in self.bob_bases:
+                selected[self.alice_bases.index(alice_basis), self.bob_bases.index(bob_basis)] = True
+        return selected[self.alice_basis_indices, self.bob_basis_indices]
+
+    def sift(self, basis_pairs: list[tuple[str, str]]) -> "BellMeasurementRecords":
+        """
+        Keep only the pairs measured in one of the given basis combinations (e.g. the key or CHSH combinations of E91).
+
+        Args:
+            basis_pairs: List of (alice_basis, bob_basis) combinations to keep.
+
+        Returns:
+            BellMeasurementRecords: The records of the kept pairs.
+        """
+        mask = self.basis_pair_mask(basis_pairs)
+        outcomes = self.outcomes[mask]
+        return BellMeasurementRecords(
+            self.alice_basis_indices[mask],
+            self.bob_basis_indices[mask],
+            outcomes >> 1,
+            outcomes & 1,
+            self.alice_bases,
+            self.bob_bases
+        )
+
+    def _count_table(self) -> np.ndarray:
+        """Number of pairs of each (Alice's basis, Bob's basis, outcome code), as an array of shape (na, nb, 4)."""
+        num_alice_bases, num_bob_bases = len(self.alice_bases), len(self.bob_bases)
+        flat_index = ((self.alice_basis_indices.astype(np.int64) * num_bob_bases + self.bob_basis_indices) * 4
+                      + self.outcomes)
+        counts = np.bincount(flat_index, minlength=num_alice_bases * num_bob_bases * 4)
+        return counts.reshape(num_alice_bases, num_bob_bases, 4)
+
+    def group_by_basis(self) -> dict[tuple[str, str], dict[str, int]]:
+        """
+        Count the outcomes of each basis combination, in the format of organize_measurements_by_basis.
+
+        Returns:
+            dict: {(alice_basis, bob_basis): {'00': count, '01': count, '10': count, '11': count}, ...}
+                  for each combination with at least one pair.
+        """
+        counts = self._count_table()
+        return {
+            (alice_basis, bob_basis): dict(zip(['00', '01', '10', '11'], counts[i, j].tolist()))
+            for i, alice_basis in enumerate(self.alice_bases)
+            for j, bob_basis in enumerate(self.bob_bases)
+            if counts[i, j].sum() > 0
+        }
+
+    def correlations(self) -> dict[tuple[str, str], float]:
+        """
+        Correlation E(a, b) = [count(00) + count(11) - count(01) - count(10)] / total of each basis combination,
+        in the format of calculate_correlations.
+
+        Returns:
+            dict: {(alice_basis, bob_basis): E(a, b), ...} for each combination with at least one pair.
+        """
+        counts = self._count_table()
+        totals = counts.sum(axis=2)
+        same_minus_different = counts[:, :, 0] + counts[:, :, 3] - counts[:, :, 1] - counts[:, :, 2]
+        return {
+            (alice_basis, bob_basis): float(same_minus_different[i, j] / totals[i, j])
+            for i, alice_basis in enumerate(self.alice_bases)
+            for j, bob_basis in enumerate(self.bob_bases)
+            if totals[i, j] > 0
+        }
+
+    def chsh_value(self, alice_bases=ALICE_BELL_BASES, bob_bases=BOB_BELL_BASES) -> float:
+        """
+        CHSH value S = E(a1, b1) - E(a1, b2) + E(a2, b1) + E(a2, b2) of the records (absolute value).
+
+        Args:
+            alice_bases: Alice's two CHSH bases (a1, a2).
+            bob_bases: Bob's two CHSH bases (b1, b2).
+
+        Returns:
+            float: The CHSH Bell parameter |S|.
+        """
+        correlations = self.correlations()
+        (a1, a2), (b1, b2) = alice_bases, bob_bases
+        return abs(correlations[(a1, b1)] - correlations[(a1, b2)] + correlations[(a2, b1)] + correlations[(a2, b2)])
+
+
 # --------------------------------------------------------
 # === DEMONSTRATION FUNCTION ===
 # --------------------------------------------------------
@@ -355,7 +997,8 @@ def run_bell_test(
     list_circuits: list[QuantumCircuit],
     name: str,
     alice_bases=ALICE_BELL_BASES,
-    bob_bases=BOB_BELL_BASES
+    bob_bases=BOB_BELL_BASES,
+    aggregate_shots=False
 ):
     """
     Run a complete Bell test on the provided circuits and print results.
@@ -365,6 +1008,8 @@ def run_bell_test(
         name: Name for this test (used in printout and plot title).
         alice_bases: List of measurement bases for Alice.
         bob_bases: List of measurement bases for Bob.
+        aggregate_shots: If True, run one circuit per prepared state and basis combination instead of
+                         one circuit per pair (see run_bell_test_measurements_aggregated).
 
     Returns:
         float: The calculated CHSH value for this test.
@@ -372,7 +1017,8 @@ def run_bell_test(
 
     print(f"\nTest: {name}")
 
-    results_list, alice_bases_list, bob_bases_list = run_bell_test_measurements(
+    measurement_function = run_bell_test_measurements_aggregated if aggregate_shots else run_bell_test_measurements
+    results_list, alice_bases_list, bob_bases_list = measurement_function(
         list_circuits, list_alice_bases=alice_bases, list_bob_bases=bob_bases)
 
     bell_results = organize_measurements_by_basis(results_list, alice_bases_list, bob_bases_list)